@@ -19,17 +19,28 @@ short_description: Build jenkins jobs
 version_added: "2.9"
 description:
   - "Build Jenkins jobs by using Jenkins REST API."
-requirements:
-  - "python-jenkins >= 1.4.0"
 options:
   name:
     description:
       - Name of the Jenkins job.
-    required: true
+      - Mutually exclusive with I(jobs), one of them is required.
+    required: false
   params:
     description:
       - Dictionary with job parameters.
     required: false
+  jobs:
+    description:
+      - List of jobs to build in one task. Each item is a dictionary with the
+        C(name) key and optional C(params) and C(build_token) keys.
+      - All jobs are triggered first and then waited for together, so the task
+        takes as long as the slowest build.
+      - The task fails without triggering any build if one of the jobs
+        doesn't exist.
+      - Mutually exclusive with I(name).
+    type: list
+    elements: dict
+    required: false
   password:
     description:
       - Password to authenticate with the Jenkins server.
@@ -43,6 +54,14 @@ options:
       - Url where the Jenkins server is accessible.
     required: false
     default: http://localhost:8080
+  validate_certs:
+    description:
+      - If set to C(no), the SSL certificates will not be validated.
+        This should only set to C(no) used on personally controlled sites
+        using self-signed certificates as it avoids verifying the source site.
+    type: bool
+    required: false
+    default: True
   user:
     description:
        - User to authenticate with the Jenkins server.
@@ -50,37 +69,215 @@ options:
   wait_build:
     description:
       - Wait until build is finished
+      - If C(no), the module returns right after the build is queued. The
+        returned handle can be passed to the M(jenkins_build_wait) module to
+        wait for the build later.
     type: bool
     required: false
     default: 'yes'
   wait_build_timeout:
     description:
       - Wait until build is finished timeout, sec
+      - Wall clock time, including the time spent in requests to Jenkins.
     required: false
     default: 600
+  wait_strategy:
+    description:
+      - How to wait for the builds.
+      - C(client) polls the queue items and the builds from the module.
+      - C(server) sends Groovy scripts to the script console that wait in
+        Jenkins until the builds are finished, one request per 50 seconds of
+        waiting. Downstream builds are still polled from the module.
+      - C(server) needs the permission to run scripts, without it the module
+        warns and falls back to C(client).
+    choices: [client, server]
+    required: false
+    default: client
+  wait_downstream:
+    description:
+      - Also wait for the builds triggered by the build, recursively, within
+        the same I(wait_build_timeout).
+      - Downstream builds are found in the C(build) steps of a pipeline and,
+        for the downstream projects of the job, by their upstream cause.
+      - Their result and duration are returned in C(downstream), and I(fail)
+        takes them into account.
+    type: bool
+    required: false
+    default: 'no'
+  poll_interval:
+    description:
+      - Initial interval between polls of the queue and of a running build, sec
+      - A running build with a known estimated duration is not polled until
+        it gets close to its expected end.
+    required: false
+    default: 1
+  max_poll_interval:
+    description:
+      - Upper limit of the interval between polls of a build that runs longer
+        than expected, sec
+    required: false
+    default: 30
   build_token:
     description:
       - Token for building job
     required: false
+  params_cache_expiration:
+    description:
+      - Number of seconds the parameter names of a job are cached in the
+        I(~/.ansible/tmp/jenkins-job-params-cache.json) file of the host the
+        module runs on.
+      - The module uses them to call the right build endpoint and to reject
+        unknown params before triggering the build.
+      - Set it to C(0) to ask Jenkins for the parameters on every run.
+    required: false
+    default: 3600
   console_output:
     description:
       - Include build console output in result
     type: bool
     required: false
     default: 'no'
+  build_info_fields:
+    description:
+      - Build fields to return in build_info, as Jenkins api C(tree) expressions,
+        for example C(number), C(result) or C(artifacts[relativePath]).
+      - Only these fields are requested from Jenkins, so a short list saves a
+        lot of traffic on builds with big test reports or many actions.
+      - The default is every field of the build api except C(actions).
+    type: list
+    elements: str
+    required: false
+  console_log_dir:
+    description:
+      - Stream the build console log into the C(<name>_<number>.log) file in
+        this directory while the build is running, instead of fetching the
+        whole log at the end.
+      - "The directory is on the host the module runs on, use
+        C(delegate_to: localhost) to keep the logs on the controller."
+      - Only the window set by I(console_output_head) and
+        I(console_output_tail) is included in the result.
+    type: path
+    required: false
+  console_output_head:
+    description:
+      - Number of lines from the start of the streamed console log included in
+        build_info.console_output.
+    required: false
+    default: 0
+  console_output_tail:
+    description:
+      - Number of lines from the end of the streamed console log included in
+        build_info.console_output.
+    required: false
+    default: 100
+  artifacts:
+    description:
+      - List of glob patterns matched against the relative path of the build
+        artifacts. Matching artifacts of the finished build are downloaded
+        into I(artifacts_dest).
+      - A file downloaded earlier from the same build with the same size is
+        not downloaded again, the build it came from is kept in a hidden
+        C(.<name>.source) file next to it. An interrupted download is resumed
+        on the next run of the same build.
+    type: list
+    elements: str
+    required: false
+  artifacts_dest:
+    description:
+      - Directory to download the artifacts to, keeping their relative path.
+        With several builds, the artifacts of every job go to a subdirectory
+        named after the job.
+    type: path
+    required: false
+  artifacts_workers:
+    description:
+      - Number of artifacts downloaded at the same time.
+    required: false
+    default: 4
   timeout:
     description:
       - The request timeout in seconds
     required: false
     default: 10
+  rate_limit:
+    description:
+      - Requests per second sent to the controller by all the tasks together,
+        C(0) is unlimited.
+      - "The tasks share a token bucket per controller url kept in a locked
+        file in C(~/.ansible/tmp) of the host the module runs on. The limit
+        only holds across the forks of a play when the tasks run on the same
+        host, use C(delegate_to: localhost) or C(connection: local) when the
+        play targets many hosts. A C(Retry-After) of the controller pauses
+        all of them."
+    type: float
+    required: false
+    default: 0
+  max_in_flight:
+    description:
+      - Requests sent to the controller at the same time by all the tasks
+        run on the same host together, C(0) is unlimited, see I(rate_limit).
+    type: int
+    required: false
+    default: 0
+  dedupe:
+    description:
+      - Do not start a build if the job already has a queued or running
+        build with the same params, wait for that build instead.
+      - The params given to the module are compared with the default values
+        of the job filled in. Every queued build of the job is looked at, the
+        running builds are looked for among the last 10 builds.
+      - Builds waited for this way are returned with C(attached) set.
+    type: bool
+    required: false
+    default: 'no'
+  metrics:
+    description:
+      - Return the C(metrics) of the task, how long it took to trigger the
+        builds, to wait for them and to fetch their results, and the requests
+        sent to Jenkins.
+    type: bool
+    required: false
+    default: 'no'
   fail:
     description:
       - Fail job if result != 'SUCCESS'
     required: false
     default: false
+  controllers:
+    description:
+      - List of Jenkins controllers to build the jobs on instead of I(url).
+        Each item is a dictionary with the C(url) key and optional C(user),
+        C(password), C(token) and C(validate_certs) keys, the options of the
+        task are used for the missing ones.
+      - The builds of every controller are triggered and waited for in their
+        own thread, each with its own I(wait_build_timeout), so a slow
+        controller doesn't hold up the others.
+      - Console logs and artifacts are written to a subdirectory of
+        I(console_log_dir) and I(artifacts_dest) named after the controller.
+    type: list
+    elements: dict
+    required: false
+  quorum:
+    description:
+      - Number of I(controllers) whose builds must succeed, all of them by
+        default. A controller fails if it can't be reached, its builds time
+        out, or, with I(fail), a build isn't successful.
+      - The task returns as soon as the quorum is reached, the controllers
+        still waiting are returned with C(status=running) and the handles of
+        their builds.
+    type: int
+    required: false
+  fail_fast:
+    description:
+      - With I(controllers), fail the task as soon as the I(quorum) can't be
+        reached anymore instead of waiting for the other controllers.
+    type: bool
+    required: false
+    default: 'no'
 author: "Vladislav Gorbunov (@vadikso), Sergio Millan Rodriguez (@sermilrod)"
 notes:
-    - Since the build can do anything this does not report on changes.
+    - Since the build can do anything this does not report on changes, only
+      downloaded artifacts make the task changed.
       Knowing the build is being run it's important to set changed_when
       for the build_info.console_output to be clear on any alterations made.
 '''
@@ -121,6 +318,120 @@ EXAMPLES = '''
     user: admin
     wait_build: false
 
+# Start a build, do something else and wait for the build at the end
+- jenkins_build:
+    name: test
+    password: admin
+    url: http://localhost:8080
+    user: admin
+    wait_build: false
+  register: test_build
+
+- jenkins_build_wait:
+    handles:
+      - "{{ test_build.handle }}"
+    password: admin
+    url: http://localhost:8080
+    user: admin
+
+# Build several jobs at once and wait for all of them
+- jenkins_build:
+    jobs:
+      - name: test
+      - name: folder1/test2
+        params:
+          'param1': 'test value 1'
+    password: admin
+    url: http://localhost:8080
+    user: admin
+
+# Build a release job and wait for all the jobs it triggers
+- jenkins_build:
+    name: release
+    password: admin
+    url: http://localhost:8080
+    user: admin
+    wait_downstream: true
+    wait_build_timeout: 3600
+    fail: true
+
+# Keep the forks of a play under 20 requests per second to the controller,
+# every host of the play builds its own job but the tasks all run on the
+# machine running Ansible, where they share the limit
+- jenkins_build:
+    name: "deploy-{{ inventory_hostname }}"
+    password: admin
+    url: http://jenkins.example.com:8080
+    user: admin
+    rate_limit: 20
+    max_in_flight: 10
+  delegate_to: localhost
+
+# Deploy on the regional controllers, two of the three must succeed
+- jenkins_build:
+    name: deploy
+    user: admin
+    token: "{{ jenkins_token }}"
+    controllers:
+      - url: https://jenkins-eu.example.com
+      - url: https://jenkins-us.example.com
+      - url: https://jenkins-ap.example.com
+        token: "{{ jenkins_ap_token }}"
+    quorum: 2
+    fail_fast: true
+    fail: true
+
+# Wait for a long build in Jenkins instead of polling it
+- jenkins_build:
+    name: nightly
+    password: admin
+    url: http://localhost:8080
+    user: admin
+    wait_strategy: server
+    wait_build_timeout: 7200
+
+# Rerunning the play waits for the release build started by the previous run
+- jenkins_build:
+    name: release
+    params:
+      VERSION: "1.2.0"
+    password: admin
+    url: http://localhost:8080
+    user: admin
+    dedupe: true
+
+# Build a jenkins job and return only its result and artifacts
+- jenkins_build:
+    name: test
+    password: admin
+    url: http://localhost:8080
+    user: admin
+    build_info_fields:
+      - number
+      - result
+      - artifacts[relativePath]
+
+# Build a jenkins job and download its jar files
+- jenkins_build:
+    name: test
+    password: admin
+    url: http://localhost:8080
+    user: admin
+    artifacts:
+      - '*.jar'
+      - 'target/*.jar'
+    artifacts_dest: /tmp/test_artifacts
+
+# Build a jenkins job with a large log, keep the log on the controller
+- jenkins_build:
+    name: test
+    password: admin
+    url: http://localhost:8080
+    user: admin
+    console_log_dir: /tmp/jenkins_logs
+    console_output_tail: 20
+  delegate_to: localhost
+
 # Build a jenkins job anonymously with job token
 - jenkins_build:
     name: test
@@ -131,7 +442,10 @@ EXAMPLES = '''
 RETURN = '''
 ---
 build_info:
-  description: Jenkins job build info.
+  description:
+    - Jenkins job build info.
+    - C(console_output) is added with I(console_output) or I(console_log_dir),
+      C(console_log) is the path of the streamed log with I(console_log_dir).
   returned: success
   type: dict
   sample: >
@@ -142,19 +456,107 @@ build_info:
     u'result': u'SUCCESS', u'executor': None, u'duration': 172,
     u'_class': u'org.jenkinsci.plugins.workflow.job.WorkflowRun', u'nextBuild': None,
     u'fullDisplayName': u'test #2', u'estimatedDuration': 905}
+handle:
+  description:
+    - Job name, queue item id and build number (null while queued) of the build,
+      to be used with M(jenkins_build_wait).
+  returned: success
+  type: dict
+  sample: >
+    {u'name': u'test', u'queue_id': 3, u'number': None}
+handles:
+  description: Handles of all the builds started with I(jobs).
+  returned: success, when I(jobs) is used
+  type: list
+attached:
+  description: True if an already queued or running build was waited for instead of starting a new one.
+  returned: success, when I(dedupe) is used
+  type: bool
+downstream:
+  description: Builds triggered by the build, each with its own C(downstream) builds.
+  returned: success, when I(wait_downstream) is used
+  type: list
+  sample: >
+    [{u'name': u'deploy', u'number': 12, u'url': u'http://localhost:8080/job/deploy/12/',
+    u'result': u'SUCCESS', u'duration': 35012, u'downstream': []}]
+metrics:
+  description:
+    - Phase timings in seconds, C(queue_time) and C(build_time) are the
+      longest ones among the builds.
+    - Number of HTTP requests in total and by endpoint, bytes received, and
+      number of polls of the queue items and builds.
+  returned: success, when I(metrics) is used
+  type: dict
+  sample: >
+    {u'trigger_time': 0.052, u'wait_time': 41.3, u'fetch_time': 0.021, u'total_time': 41.4,
+    u'queue_time': 5.21, u'build_time': 36.0, u'requests': 11,
+    u'requests_by_endpoint': {u'queue/item/*/api/json': 4, u'job/*/*/api/json': 5, ...},
+    u'bytes_received': 5120, u'poll_iterations': 9}
+artifacts:
+  description: Downloaded artifacts, C(status) is one of C(downloaded), C(resumed) or C(skipped).
+  returned: success, when I(artifacts) is used
+  type: list
+  sample: >
+    [{u'path': u'target/app.jar', u'dest': u'/tmp/test_artifacts/target/app.jar',
+    u'size': 1048576, u'status': u'downloaded'}]
+queue_info:
+  description:
+    - Queue item of the build. C(wait_time) is the time in seconds the item
+      spent in the queue, C(why) is the last reason Jenkins gave for waiting.
+    - The task fails if the queue item is cancelled.
+  returned: success
+  type: dict
+  sample: >
+    {u'id': 3, u'why': None, u'cancelled': False, u'wait_time': 4.52}
+controllers:
+  description:
+    - Result of every controller of I(controllers), with its C(url), its
+      C(status), one of C(success), C(failed) or C(running), a C(msg) if it
+      failed, and the keys returned for a single controller.
+  returned: success, when I(controllers) is used
+  type: list
+  sample: >
+    [{u'url': u'https://jenkins-eu.example.com', u'status': u'success', u'build_info': {...}, ...},
+    {u'url': u'https://jenkins-us.example.com', u'status': u'running',
+    u'handle': {u'name': u'deploy', u'queue_id': 12, u'number': 7}}]
+builds:
+  description: Job name, handle, queue info and build info of every build started with I(jobs).
+  returned: success, when I(jobs) is used
+  type: list
+  sample: >
+    [{u'name': u'test', u'handle': {...}, u'queue_info': {u'id': 3, ...},
+    u'build_info': {u'number': 2, u'result': u'SUCCESS', ...}}]
 '''
 
+import os
+import re
+import threading
 import traceback
-import time
-import uuid
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils._text import to_native
-
-try:
-    import jenkins
-    python_jenkins_installed = True
-except ImportError:
-    python_jenkins_installed = False
+from ansible.module_utils.six.moves import queue
+from ansible.module_utils.six.moves.urllib.parse import urlencode, urlsplit
+from ansible.module_utils.jenkins_builds import BuildWaiter, BUILD_INFO_FIELDS, get_job_json
+from ansible.module_utils.jenkins_client import (get_jenkins_client, job_url, JenkinsError, JobParamsCache, NotFoundError,
+                                                 POOL_SIZE)
+
+BUILD_JOB = '%(folder_url)sjob/%(short_name)s/build'
+BUILD_WITH_PARAMS_JOB = '%(folder_url)sjob/%(short_name)s/buildWithParameters'
+ACTIVE_BUILDS = ('%(folder_url)sjob/%(short_name)s/api/json?tree='
+                 'property[parameterDefinitions[name,defaultParameterValue[value]]],'
+                 'builds[number,queueId,building,actions[parameters[name,value]]]{0,%(limit)d}')
+# The queueItem of a job is only its first item in the queue, the others are
+# found in the whole queue
+QUEUED_BUILDS = 'queue/api/json?tree=items[id,params,task[fullName]]'
+# Running builds are looked for among the latest ones only
+ACTIVE_BUILDS_LIMIT = 10
+
+
+def param_value(value):
+    """Return the parameter value as Jenkins shows it in the queue."""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return to_native(value)
 
 
 class JenkinsBuild:
@@ -164,130 +566,378 @@ class JenkinsBuild:
 
         self.params = module.params.get('params')
         self.name = module.params.get('name')
+        self.jobs = module.params.get('jobs')
         self.password = module.params.get('password')
         self.token = module.params.get('token')
         self.user = module.params.get('user')
         self.jenkins_url = module.params.get('url')
         self.wait_build = module.params.get('wait_build')
-        self.wait_build_timeout = module.params.get('wait_build_timeout')
         self.build_token = module.params.get('build_token')
-        self.build_number = 1
         self.timeout = module.params.get('timeout')
-        self.console_output = module.params.get('console_output')
+        self.dedupe = module.params.get('dedupe')
         self.fail = module.params.get('fail')
 
-        self.server = self.get_jenkins_connection()
+        self.client = get_jenkins_client(module, max(POOL_SIZE, module.params.get('artifacts_workers')))
+        self.waiter = BuildWaiter(module, self.client)
+        self.params_cache = JobParamsCache(module, self.client, module.params.get('params_cache_expiration'))
 
-        self.result = {
-            'build_info': {}
-        }
+        if self.jobs:
+            self.result = {
+                'builds': [],
+                'handles': []
+            }
+        else:
+            self.result = {
+                'build_info': {}
+            }
 
-    def is_fail(self):
-        return self.fail
+    def handles(self):
+        """Return the handles of the builds triggered so far."""
+        return [self.waiter.handle(build) for build in getattr(self, 'builds', [])]
 
-    def get_jenkins_connection(self):
+    def is_fail(self):
+        if not self.fail:
+            return False
+        if self.jobs:
+            return not all(self.waiter.is_success(build) for build in self.result['builds'])
+        return not self.waiter.is_success(self.result)
+
+    def queue_build(self, name, params, param_names, build_token):
+        """Send the build request, return the queue id from the Location header."""
+        url = job_url(BUILD_WITH_PARAMS_JOB if param_names else BUILD_JOB, name)
+        query = dict(params)
+        if build_token:
+            query['token'] = build_token
+        if query:
+            url += '?' + urlencode(query)
+        response = self.client.open('POST', url)
+        return int(response.header('Location').rstrip('/').split('/')[-1])
+
+    def find_active_build(self, name, params):
+        """Return the queue id and number of a queued or running build with the same params, or None."""
         try:
-            if (self.user and self.password):
-                return jenkins.Jenkins(self.jenkins_url, self.user, self.password, self.timeout)
-            elif (self.user and self.token):
-                return jenkins.Jenkins(self.jenkins_url, self.user, self.token, self.timeout)
-            elif (self.user and not (self.password or self.token)):
-                return jenkins.Jenkins(self.jenkins_url, self.user, timeout=self.timeout)
-            else:
-                return jenkins.Jenkins(self.jenkins_url, timeout=self.timeout)
+            job = get_job_json(self.client, ACTIVE_BUILDS, name, limit=ACTIVE_BUILDS_LIMIT)
+        except NotFoundError:
+            return None
         except Exception as e:
-            self.module.fail_json(msg='Unable to connect to Jenkins server, %s' % to_native(e),
+            self.module.fail_json(msg='Unable to look for the active builds of %s, %s' % (name, to_native(e)),
                                   exception=traceback.format_exc())
-
-    def job_exists(self):
+        expected = {}
+        for prop in job.get('property', []):
+            for definition in prop.get('parameterDefinitions', []):
+                if definition.get('defaultParameterValue'):
+                    expected[definition['name']] = param_value(definition['defaultParameterValue'].get('value'))
+        expected.update((key, param_value(value)) for key, value in params.items())
+
+        def matches(actual):
+            return all(actual.get(key) == value for key, value in expected.items())
+
+        # The oldest running build is the first one to finish
+        for build in reversed(job.get('builds', [])):
+            actual = dict((param['name'], param_value(param.get('value')))
+                          for action in build.get('actions', []) for param in action.get('parameters', []))
+            if build.get('building') and matches(actual):
+                return build.get('queueId'), build['number']
         try:
-            return bool(self.server.job_exists(self.name))
+            items = self.client.get_json(QUEUED_BUILDS).get('items') or []
         except Exception as e:
-            self.module.fail_json(msg='Unable to validate if job exists, %s for %s' % (to_native(e),
-                                  self.jenkins_url), exception=traceback.format_exc())
-
-    def wait_job_build(self):
-        for __ in range(1, self.wait_build_timeout):
-            if self.server.get_build_info(self.name, self.build_number)['building']:
-                time.sleep(1)
-            else:
-                return
-        self.module.fail_json(msg='Job build complete timeout exceed, %s for %s' % (self.name,
-                              self.jenkins_url),
-                              exception=traceback.format_exc())
+            self.module.fail_json(msg='Unable to look for the queued builds of %s, %s' % (name, to_native(e)),
+                                  exception=traceback.format_exc())
+        # The oldest queued build is the first one to start
+        for item in sorted(items, key=lambda item: item['id']):
+            if (item.get('task') or {}).get('fullName') != name:
+                continue
+            # Queued params are a "\nname=value" string
+            actual = dict(line.split('=', 1) for line in (item.get('params') or '').split('\n') if '=' in line)
+            if matches(actual):
+                return item['id'], None
+        return None
+
+    def check_jobs_exist(self, builds):
+        """Fail before triggering anything if some of the jobs don't exist."""
+        missing = [build['name'] for build in builds if self.params_cache.get(build['name']) is None]
+        if missing:
+            self.params_cache.save()
+            self.module.fail_json(msg='Jobs not found: %s' % ', '.join(missing))
+
+    def trigger_build(self, build, refresh=False):
+        """Queue the build, return False if the job doesn't exist."""
+        param_names = self.params_cache.get(build['name'], refresh)
+        if param_names is None:
+            return False
+        params = build['params'] or {}
+        unknown = sorted(set(params) - set(param_names))
+        if unknown and not self.params_cache.is_fresh(build['name']):
+            # The parameters may have been added since they were cached
+            return self.trigger_build(build, refresh=True)
+        if unknown:
+            self.module.fail_json(msg='Job %s has no parameters %s, its parameters are: %s' % (
+                                  build['name'], ', '.join(unknown), ', '.join(param_names) or 'none'))
+        if self.dedupe:
+            active = self.find_active_build(build['name'], params)
+            if active is not None:
+                self.waiter.track(build, *active)
+                build['attached'] = True
+                return True
+        try:
+            queue_id = self.queue_build(build['name'], params, param_names, build['build_token'])
+        except NotFoundError:
+            return False
+        except JenkinsError as e:
+            if not self.params_cache.is_fresh(build['name']):
+                # The job may have been reconfigured since its parameters were cached
+                return self.trigger_build(build, refresh=True)
+            self.module.fail_json(msg='Unable to build %s, %s' % (build['name'], to_native(e)),
+                                  exception=traceback.format_exc())
+        except Exception:
+            self.module.fail_json(msg='Runtime error in module jenkins_build: %s' % traceback.format_exc())
+        self.waiter.track(build, queue_id)
+        return True
 
     def build_job(self):
         result = self.result
-        if not self.module.check_mode and self.job_exists():
-            try:
-                try:
-                    self.build_number = self.server.get_job_info(self.name)['nextBuildNumber']
-                except Exception as e:
-                    self.module.fail_json(msg='Fail to get nextBuildNumber: %s' % str(e))
-                queue_id = self.server.build_job(self.name, self.params, self.build_token)
-                for __ in range(1, self.wait_build_timeout):
-                    queue_item = self.server.get_queue_item(queue_id)
-                    if (queue_item is not None) \
-                       and ('executable' in queue_item) \
-                       and (queue_item['executable'] is not None) \
-                       and ('number' in queue_item['executable']):
-                        self.build_number = queue_item['executable']['number']
-                        break
-                    time.sleep(1)
-            except Exception as e:
-                if str(e) == 'Error in request. Possibly authentication failed [500]: Server Error':
-                    self.module.fail_json(msg="Error in request. Possibly call job that can't handle "
-                                              "parameters. Server Error 500.")
-                elif str(e) == 'HTTP Error 400: Nothing is submitted':
-                    # pass random parameter if it not defined in params field
-                    # Job is build with default parameters
-                    self.params = {uuid.uuid4(): uuid.uuid4()}
-                    self.build_job()
-                else:
-                    self.module.fail_json(msg='Runtime error in module jenkins_build: %s' % traceback.format_exc())
+        if self.jobs:
+            builds = [dict(name=job['name'], params=job['params'],
+                           build_token=job['build_token'] if job['build_token'] is not None else self.build_token)
+                      for job in self.jobs]
+        else:
+            builds = [dict(name=self.name, params=self.params, build_token=self.build_token)]
+        if self.module.check_mode:
+            return result
+        metrics = self.waiter.metrics
+        with metrics.measure('trigger'):
+            if self.jobs:
+                self.check_jobs_exist(builds)
+            triggered = [build for build in builds if self.trigger_build(build)]
+            self.params_cache.save()
+            self.builds = triggered
+            if self.jobs and len(triggered) < len(builds):
+                # Deleted since the check, the builds of the other jobs are already queued
+                self.module.fail_json(msg='Jobs not found: %s' % ', '.join(
+                                      build['name'] for build in builds if build not in triggered),
+                                      handles=self.handles())
+            builds = triggered
+        with metrics.measure('wait'):
             if self.wait_build:
-                self.wait_job_build()
-            result['build_info'] = self.server.get_build_info(self.name, self.build_number)
-            del result['build_info']['actions']
-            if self.console_output:
-                result['build_info']['console_output'] = self.server.get_build_console_output(
-                    self.name, number=self.build_number)
+                self.waiter.wait(builds)
+            else:
+                # Look at the queue once, the build number is returned only if the build has already started
+                for build in builds:
+                    self.waiter.poll_queue(build)
+        with metrics.measure('fetch'):
+            # Artifacts are only fetched from finished builds
+            collected = self.waiter.collect(builds, fetch_artifacts=self.wait_build)
+        if self.dedupe:
+            for entry, build in zip(collected, builds):
+                entry['attached'] = build.get('attached', False)
+        if self.module.params.get('metrics'):
+            result['metrics'] = metrics.result(builds)
+        if self.jobs:
+            result['builds'] = collected
+            result['handles'] = [build['handle'] for build in collected]
+        elif collected:
+            result.update(collected[0])
+            del result['name']
+        result['changed'] = any(artifact['status'] != 'skipped'
+                                for build in collected for artifact in build.get('artifacts', []))
+        self.waiter.check_cancelled(builds, result)
         return result
 
 
-def test_dependencies(module):
-    if not python_jenkins_installed:
-        module.fail_json(msg="python-jenkins >= 1.4.0 required for this module. "
-                         "see http://python-jenkins.readthedocs.io/en/latest/install.html")
+class ControllerFailed(Exception):
+
+    def __init__(self, result):
+        super(ControllerFailed, self).__init__(result.get('msg'))
+        self.result = result
+
+
+class ControllerModule:
+    """The module as seen by the builds of one of I(controllers).
+
+    The params are those of the task with the url and credentials of the
+    controller. fail_json raises ControllerFailed so the other controllers
+    go on.
+    """
+
+    def __init__(self, module, controller, subdir):
+        self.module = module
+        self.params = dict(module.params)
+        self.params.update((key, value) for key, value in controller.items() if value is not None)
+        if controller.get('password') is not None:
+            self.params['token'] = None
+        elif controller.get('token') is not None:
+            self.params['password'] = None
+        for option in ('console_log_dir', 'artifacts_dest'):
+            if self.params.get(option):
+                self.params[option] = os.path.join(self.params[option], subdir)
+
+    def fail_json(self, **result):
+        raise ControllerFailed(result)
+
+    def warn(self, warning):
+        self.module.warn('%s: %s' % (self.params['url'], warning))
+
+    def __getattr__(self, name):
+        return getattr(self.module, name)
+
+
+class ControllerFanOut:
+    """Build the jobs on several controllers at once.
+
+    Every controller runs JenkinsBuild in a thread of its own. Results are
+    gathered as the controllers finish, the task ends once the quorum is
+    reached or, with I(fail_fast), once it can't be anymore.
+    """
+
+    def __init__(self, module):
+        self.module = module
+        self.controllers = module.params.get('controllers')
+        self.quorum = module.params.get('quorum') or len(self.controllers)
+        self.fail_fast = module.params.get('fail_fast')
+
+        if not 1 <= self.quorum <= len(self.controllers):
+            module.fail_json(msg='quorum must be between 1 and the number of controllers, %d' % len(self.controllers))
+
+        self.results = queue.Queue()
+        self.runs = []
+        self.result = {
+            'controllers': []
+        }
+
+    def subdir(self, url):
+        """Return the directory name of the controller for its console logs and artifacts."""
+        parts = urlsplit(url)
+        return re.sub(r'[^\w.-]+', '_', (parts.netloc + parts.path).strip('/'))
+
+    def run(self, index, module):
+        try:
+            jenkins_build = JenkinsBuild(module)
+            self.runs[index]['build'] = jenkins_build
+            result = jenkins_build.build_job()
+            if jenkins_build.is_fail():
+                result.update(status='failed', msg='Jenkins job build failed')
+            else:
+                result['status'] = 'success'
+        except ControllerFailed as e:
+            result = dict(e.result, status='failed')
+        except JenkinsError as e:
+            result = dict(status='failed', msg=to_native(e), exception=traceback.format_exc())
+        except Exception as e:
+            result = dict(status='failed', msg='Runtime error in module jenkins_build: %s' % to_native(e),
+                          exception=traceback.format_exc())
+        result.pop('invocation', None)
+        self.results.put((index, result))
+
+    def build_job(self):
+        result = self.result
+        for index, controller in enumerate(self.controllers):
+            module = ControllerModule(self.module, controller, self.subdir(controller['url']))
+            thread = threading.Thread(target=self.run, args=(index, module))
+            # Threads of the controllers still waiting end with the task
+            thread.daemon = True
+            self.runs.append(dict(url=module.params['url'], thread=thread, build=None, result=None))
+        for run in self.runs:
+            run['thread'].start()
+
+        succeeded = failed = 0
+        for done in range(len(self.runs)):
+            index, controller_result = self.results.get()
+            self.runs[index]['result'] = controller_result
+            if controller_result['status'] == 'success':
+                succeeded += 1
+            else:
+                failed += 1
+            if succeeded >= self.quorum or self.fail_fast and failed > len(self.runs) - self.quorum:
+                break
+
+        for run in self.runs:
+            controller_result = run['result']
+            if controller_result is None:
+                # Still waiting, its builds can be followed with jenkins_build_wait
+                controller_result = dict(status='running')
+                handles = run['build'].handles() if run['build'] is not None else []
+                if self.module.params.get('jobs'):
+                    controller_result['handles'] = handles
+                elif handles:
+                    controller_result['handle'] = handles[0]
+            result['controllers'].append(dict(controller_result, url=run['url']))
+        result['changed'] = any(entry.get('changed') for entry in result['controllers'])
+        if succeeded < self.quorum:
+            failures = ['%s: %s' % (entry['url'], entry.get('msg'))
+                        for entry in result['controllers'] if entry['status'] == 'failed']
+            result['msg'] = 'Builds succeeded on %d of the %d controllers needed, %s' % (
+                succeeded, self.quorum, '; '.join(failures))
+            self.module.fail_json(**result)
+        return result
 
 
 def main():
     module = AnsibleModule(
         argument_spec=dict(
             params=dict(required=False, default=None, type='dict'),
-            name=dict(required=True),
+            name=dict(required=False),
+            jobs=dict(required=False, default=None, type='list', elements='dict', options=dict(
+                name=dict(required=True),
+                params=dict(required=False, default=None, type='dict'),
+                build_token=dict(required=False, default=None, no_log=True)
+            )),
             password=dict(required=False, no_log=True),
             token=dict(required=False, no_log=True),
             url=dict(required=False, default="http://localhost:8080"),
+            validate_certs=dict(required=False, type="bool", default=True),
             user=dict(required=False),
             wait_build=dict(required=False, default=True, type='bool'),
             wait_build_timeout=dict(required=False, default=600, type='int'),
+            wait_strategy=dict(required=False, default='client', choices=['client', 'server']),
+            wait_downstream=dict(required=False, default=False, type='bool'),
+            poll_interval=dict(required=False, default=1, type='float'),
+            max_poll_interval=dict(required=False, default=30, type='float'),
             build_token=dict(required=False, default=None, no_log=True),
+            params_cache_expiration=dict(required=False, default=3600, type='int'),
             timeout=dict(required=False, type="int", default=10),
+            rate_limit=dict(required=False, default=0, type='float'),
+            max_in_flight=dict(required=False, default=0, type='int'),
             console_output=dict(required=False, default=False, type='bool'),
-            fail=dict(required=False, default=False, type='bool')
+            build_info_fields=dict(required=False, default=BUILD_INFO_FIELDS, type='list', elements='str'),
+            console_log_dir=dict(required=False, default=None, type='path'),
+            console_output_head=dict(required=False, default=0, type='int'),
+            console_output_tail=dict(required=False, default=100, type='int'),
+            artifacts=dict(required=False, default=None, type='list', elements='str'),
+            artifacts_dest=dict(required=False, default=None, type='path'),
+            artifacts_workers=dict(required=False, default=4, type='int'),
+            dedupe=dict(required=False, default=False, type='bool'),
+            metrics=dict(required=False, default=False, type='bool'),
+            fail=dict(required=False, default=False, type='bool'),
+            controllers=dict(required=False, default=None, type='list', elements='dict', options=dict(
+                url=dict(required=True),
+                user=dict(required=False, default=None),
+                password=dict(required=False, default=None, no_log=True),
+                token=dict(required=False, default=None, no_log=True),
+                validate_certs=dict(required=False, default=None, type='bool')
+            ), mutually_exclusive=[['password', 'token']]),
+            quorum=dict(required=False, default=None, type='int'),
+            fail_fast=dict(required=False, default=False, type='bool')
         ),
         mutually_exclusive=[
             ['password', 'token'],
+            ['name', 'jobs'],
+        ],
+        required_together=[
+            ['artifacts', 'artifacts_dest'],
+        ],
+        required_one_of=[
+            ['name', 'jobs'],
         ],
         supports_check_mode=True,
     )
 
-    test_dependencies(module)
+    if module.params['controllers']:
+        module.exit_json(**ControllerFanOut(module).build_job())
+
     jenkins_build = JenkinsBuild(module)
 
     result = jenkins_build.build_job()
-    if jenkins_build.is_fail() and result['build_info']['result'] != 'SUCCESS':
+    if jenkins_build.is_fail():
         result['msg'] = "Jenkins job build failed"
         module.fail_json(**result)
     else:
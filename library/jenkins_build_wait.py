@@ -0,0 +1,282 @@
+#!/usr/bin/python
+#
+# Copyright: (c) Ansible Project
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+
+DOCUMENTATION = '''
+---
+module: jenkins_build_wait
+short_description: Wait for jenkins builds started earlier
+version_added: "2.9"
+description:
+  - "Wait for Jenkins builds started by M(jenkins_build) with C(wait_build: no)."
+  - "All builds are followed from one poll loop, so the task takes as long as the slowest build."
+options:
+  handles:
+    description:
+      - List of build handles returned by M(jenkins_build) in C(handle) or C(handles).
+      - A handle is a dictionary with the C(name) of the job, the C(queue_id)
+        and the C(number) of the build if it is already known.
+    type: list
+    elements: dict
+    required: true
+  password:
+    description:
+      - Password to authenticate with the Jenkins server.
+    required: false
+  token:
+    description:
+      - API token used to authenticate alternatively to password.
+    required: false
+  url:
+    description:
+      - Url where the Jenkins server is accessible.
+    required: false
+    default: http://localhost:8080
+  validate_certs:
+    description:
+      - If set to C(no), the SSL certificates will not be validated.
+        This should only set to C(no) used on personally controlled sites
+        using self-signed certificates as it avoids verifying the source site.
+    type: bool
+    required: false
+    default: True
+  user:
+    description:
+       - User to authenticate with the Jenkins server.
+    required: false
+  wait_build_timeout:
+    description:
+      - Wait until builds are finished timeout, sec
+    required: false
+    default: 600
+  wait_strategy:
+    description:
+      - How to wait for the builds.
+      - C(client) polls the queue items and the builds from the module.
+      - C(server) sends Groovy scripts to the script console that wait in
+        Jenkins until the builds are finished, one request per 50 seconds of
+        waiting. Downstream builds are still polled from the module.
+      - C(server) needs the permission to run scripts, without it the module
+        warns and falls back to C(client).
+    choices: [client, server]
+    required: false
+    default: client
+  poll_interval:
+    description:
+      - Initial interval between polls of the queue and of a running build, sec
+    required: false
+    default: 1
+  max_poll_interval:
+    description:
+      - Upper limit of the interval between polls of a build that runs longer
+        than expected, sec
+    required: false
+    default: 30
+  console_output:
+    description:
+      - Include build console output in result
+    type: bool
+    required: false
+    default: 'no'
+  build_info_fields:
+    description:
+      - Build fields to return in build_info, as Jenkins api C(tree) expressions.
+      - The default is every field of the build api except C(actions).
+    type: list
+    elements: str
+    required: false
+  console_log_dir:
+    description:
+      - Stream the build console logs into C(<name>_<number>.log) files in
+        this directory, see M(jenkins_build).
+    type: path
+    required: false
+  console_output_head:
+    description:
+      - Number of lines from the start of the streamed console log included in
+        build_info.console_output.
+    required: false
+    default: 0
+  console_output_tail:
+    description:
+      - Number of lines from the end of the streamed console log included in
+        build_info.console_output.
+    required: false
+    default: 100
+  timeout:
+    description:
+      - The request timeout in seconds
+    required: false
+    default: 10
+  rate_limit:
+    description:
+      - Requests per second sent to the controller by all the tasks run on
+        the same host together, C(0) is unlimited, see M(jenkins_build).
+    type: float
+    required: false
+    default: 0
+  max_in_flight:
+    description:
+      - Requests sent to the controller at the same time by all the tasks
+        run on the same host together, C(0) is unlimited.
+    type: int
+    required: false
+    default: 0
+  metrics:
+    description:
+      - Return the C(metrics) of the task, see M(jenkins_build).
+    type: bool
+    required: false
+    default: 'no'
+  fail:
+    description:
+      - Fail job if result != 'SUCCESS' for any of the builds
+    required: false
+    default: false
+author: "Vladislav Gorbunov (@vadikso)"
+'''
+
+EXAMPLES = '''
+# Start two builds, run other tasks and wait for both builds at the end
+- jenkins_build:
+    name: test
+    password: admin
+    url: http://localhost:8080
+    user: admin
+    wait_build: false
+  register: test_build
+
+- jenkins_build:
+    jobs:
+      - name: folder1/test2
+      - name: folder1/test3
+    password: admin
+    url: http://localhost:8080
+    user: admin
+    wait_build: false
+  register: folder_builds
+
+- jenkins_build_wait:
+    handles: "{{ [test_build.handle] + folder_builds.handles }}"
+    password: admin
+    url: http://localhost:8080
+    user: admin
+    fail: true
+'''
+
+RETURN = '''
+---
+builds:
+  description: Job name, handle, queue info and build info of every build, see M(jenkins_build).
+  returned: success
+  type: list
+  sample: >
+    [{u'name': u'test', u'handle': {u'name': u'test', u'queue_id': 3, u'number': 2},
+    u'queue_info': {u'id': 3, ...}, u'build_info': {u'number': 2, u'result': u'SUCCESS', ...}}]
+metrics:
+  description: Phase timings, requests sent to Jenkins and polls, see M(jenkins_build).
+  returned: success, when I(metrics) is used
+  type: dict
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.jenkins_builds import BuildWaiter, BUILD_INFO_FIELDS
+from ansible.module_utils.jenkins_client import get_jenkins_client
+
+
+class JenkinsBuildWait:
+
+    def __init__(self, module):
+        self.module = module
+
+        self.handles = module.params.get('handles')
+        self.password = module.params.get('password')
+        self.token = module.params.get('token')
+        self.user = module.params.get('user')
+        self.jenkins_url = module.params.get('url')
+        self.timeout = module.params.get('timeout')
+        self.fail = module.params.get('fail')
+
+        self.client = get_jenkins_client(module)
+        self.waiter = BuildWaiter(module, self.client)
+
+        self.result = {
+            'builds': []
+        }
+
+    def is_fail(self):
+        return self.fail and not all(self.waiter.is_success(build) for build in self.result['builds'])
+
+    def wait_builds(self):
+        result = self.result
+        builds = []
+        for handle in self.handles:
+            if not handle.get('name') or (handle.get('queue_id') is None and handle.get('number') is None):
+                self.module.fail_json(msg='Build handle needs the job name and a queue_id or a build number: %s'
+                                          % handle)
+            builds.append(self.waiter.track(dict(name=handle['name']), handle.get('queue_id'), handle.get('number')))
+        if self.module.check_mode:
+            return result
+        metrics = self.waiter.metrics
+        with metrics.measure('wait'):
+            self.waiter.wait(builds)
+        with metrics.measure('fetch'):
+            result['builds'] = self.waiter.collect(builds)
+        if self.module.params.get('metrics'):
+            result['metrics'] = metrics.result(builds)
+        self.waiter.check_cancelled(builds, result)
+        return result
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            handles=dict(required=True, type='list', elements='dict'),
+            password=dict(required=False, no_log=True),
+            token=dict(required=False, no_log=True),
+            url=dict(required=False, default="http://localhost:8080"),
+            validate_certs=dict(required=False, type="bool", default=True),
+            user=dict(required=False),
+            wait_build_timeout=dict(required=False, default=600, type='int'),
+            wait_strategy=dict(required=False, default='client', choices=['client', 'server']),
+            poll_interval=dict(required=False, default=1, type='float'),
+            max_poll_interval=dict(required=False, default=30, type='float'),
+            timeout=dict(required=False, type="int", default=10),
+            rate_limit=dict(required=False, default=0, type='float'),
+            max_in_flight=dict(required=False, default=0, type='int'),
+            console_output=dict(required=False, default=False, type='bool'),
+            build_info_fields=dict(required=False, default=BUILD_INFO_FIELDS, type='list', elements='str'),
+            console_log_dir=dict(required=False, default=None, type='path'),
+            console_output_head=dict(required=False, default=0, type='int'),
+            console_output_tail=dict(required=False, default=100, type='int'),
+            metrics=dict(required=False, default=False, type='bool'),
+            fail=dict(required=False, default=False, type='bool')
+        ),
+        mutually_exclusive=[
+            ['password', 'token'],
+        ],
+        supports_check_mode=True,
+    )
+
+    jenkins_build_wait = JenkinsBuildWait(module)
+
+    result = jenkins_build_wait.wait_builds()
+    if jenkins_build_wait.is_fail():
+        result['msg'] = "Jenkins job build failed"
+        module.fail_json(**result)
+    else:
+        module.exit_json(**result)
+
+
+if __name__ == '__main__':
+    main()
@@ -51,6 +51,19 @@ options:
     description:
       - Server connection timeout in secs.
     default: 30
+  rate_limit:
+    description:
+      - Requests per second sent to Jenkins by all the tasks run on the same
+        host together, C(0) is unlimited, see M(jenkins_build). The update center is not
+        limited.
+    type: float
+    default: 0
+  max_in_flight:
+    description:
+      - Requests sent to Jenkins at the same time by all the tasks run on the
+        same host together, C(0) is unlimited.
+    type: int
+    default: 0
   updates_expiration:
     description:
       - Number of seconds after which a new copy of the I(update-center.json)
@@ -100,6 +113,12 @@ notes:
     host where Jenkins runs as it needs direct access to the plugin files.
   - "The C(params) option was removed in Ansible 2.5 due to circumventing Ansible's
     option handling"
+  - Requests to Jenkins reuse one keep-alive connection. The I(updates_url)
+    downloads are sent without the Jenkins credentials, put the credentials
+    of a private update center in I(updates_url) itself.
+  - The CSRF crumb of Jenkins is cached for 5 minutes in the
+    I(~/.ansible/tmp/jenkins-crumb-cache.json) file, so the tasks that follow
+    don't ask Jenkins for it again.
 extends_documentation_fragment:
   - url
 '''
@@ -262,9 +281,9 @@ state:
 '''
 
 from ansible.module_utils.basic import AnsibleModule, to_bytes
-from ansible.module_utils.six.moves.urllib.parse import urlencode
 from ansible.module_utils.urls import fetch_url, url_argument_spec
 from ansible.module_utils._text import to_native
+from ansible.module_utils.jenkins_client import JenkinsClient
 import base64
 import hashlib
 import json
@@ -283,33 +302,23 @@ class JenkinsPlugin(object):
         self.url = self.params['url']
         self.timeout = self.params['timeout']
 
-        # Crumb
-        self.crumb = {}
-
-        if self._csrf_enabled():
-            self.crumb = self._get_crumb()
+        # Connection to Jenkins, the update center is reached with fetch_url.
+        # The client adds the crumb to the POST requests.
+        self.client = JenkinsClient(
+            module, self.url, self.params['url_username'],
+            self.params['url_password'], self.timeout,
+            self.params['validate_certs'])
 
         # Get list of installed plugins
         self._get_installed_plugins()
 
-    def _csrf_enabled(self):
-        csrf_data = self._get_json_data(
-            "%s/%s" % (self.url, "api/json"), 'CSRF')
-
-        if 'useCrumbs' not in csrf_data:
-            self.module.fail_json(
-                msg="Required fields not found in the Crumbs response.",
-                details=csrf_data)
-
-        return csrf_data['useCrumbs']
-
-    def _get_json_data(self, url, what, **kwargs):
+    def _get_json_data(self, path, what):
         # Get the JSON data
-        r = self._get_url_data(url, what, **kwargs)
+        r = self._get_jenkins_data(path, what)
 
         # Parse the JSON data
         try:
-            json_data = json.loads(to_native(r.read()))
+            json_data = json.loads(to_native(r.content))
         except Exception as e:
             self.module.fail_json(
                 msg="Cannot parse %s JSON data." % what,
@@ -327,7 +336,13 @@ class JenkinsPlugin(object):
         if msg_exception is None:
             msg_exception = "Retrieval of %s failed." % what
 
-        # Get the URL data
+        # Get the URL data, fetch_url takes the credentials from the params
+        # and they are those of Jenkins, not of the update center
+        credentials = dict(
+            (key, self.params[key])
+            for key in ('url_username', 'url_password', 'force_basic_auth'))
+        self.params.update(
+            url_username=None, url_password=None, force_basic_auth=False)
         try:
             response, info = fetch_url(
                 self.module, url, timeout=self.timeout, **kwargs)
@@ -336,28 +351,39 @@ class JenkinsPlugin(object):
                 self.module.fail_json(msg=msg_status, details=info['msg'])
         except Exception as e:
             self.module.fail_json(msg=msg_exception, details=to_native(e))
+        finally:
+            self.params.update(credentials)
 
         return response
 
-    def _get_crumb(self):
-        crumb_data = self._get_json_data(
-            "%s/%s" % (self.url, "crumbIssuer/api/json"), 'Crumb')
+    def _get_jenkins_data(
+            self, path, what=None, msg_status=None, msg_exception=None,
+            data=None):
+        # Compose default messages
+        if msg_status is None:
+            msg_status = "Cannot get %s" % what
+
+        if msg_exception is None:
+            msg_exception = "Retrieval of %s failed." % what
 
-        if 'crumbRequestField' in crumb_data and 'crumb' in crumb_data:
-            ret = {
-                crumb_data['crumbRequestField']: crumb_data['crumb']
-            }
-        else:
+        # Send the request, it's a POST if there is data
+        try:
+            response = self.client.request(
+                'GET' if data is None else 'POST', path, data=data)
+        except Exception as e:
+            self.module.fail_json(msg=msg_exception, details=to_native(e))
+
+        if response.status != 200:
             self.module.fail_json(
-                msg="Required fields not found in the Crum response.",
-                details=crumb_data)
+                msg=msg_status,
+                details="HTTP Error %s: %s" % (
+                    response.status, response.reason))
 
-        return ret
+        return response
 
     def _get_installed_plugins(self):
         plugins_data = self._get_json_data(
-            "%s/%s" % (self.url, "pluginManager/api/json?depth=1"),
-            'list of plugins')
+            "pluginManager/api/json?depth=1", 'list of plugins')
 
         # Check if we got valid data
         if 'plugins' not in plugins_data:
@@ -403,15 +429,13 @@ class JenkinsPlugin(object):
                 script_data = {
                     'script': install_script
                 }
-                script_data.update(self.crumb)
-                data = urlencode(script_data)
 
                 # Send the installation request
-                r = self._get_url_data(
-                    "%s/scriptText" % self.url,
+                self._get_jenkins_data(
+                    "scriptText",
                     msg_status="Cannot install plugin.",
                     msg_exception="Plugin installation has failed.",
-                    data=data)
+                    data=script_data)
 
                 hpi_file = '%s/plugins/%s.hpi' % (
                     self.params['jenkins_home'],
@@ -677,16 +701,14 @@ class JenkinsPlugin(object):
         return changed
 
     def _pm_query(self, action, msg):
-        url = "%s/pluginManager/plugin/%s/%s" % (
-            self.params['url'], self.params['name'], action)
-        data = urlencode(self.crumb)
+        path = "pluginManager/plugin/%s/%s" % (self.params['name'], action)
 
         # Send the request
-        self._get_url_data(
-            url,
-            msg_status="Plugin not found. %s" % url,
+        self._get_jenkins_data(
+            path,
+            msg_status="Plugin not found. %s/%s" % (self.url, path),
             msg_exception="%s has failed." % msg,
-            data=data)
+            data={})
 
 
 def main():
@@ -710,6 +732,8 @@ def main():
                 'latest'],
             default='present'),
         timeout=dict(default=30, type="int"),
+        rate_limit=dict(default=0, type='float'),
+        max_in_flight=dict(default=0, type='int'),
         updates_expiration=dict(default=86400, type="int"),
         updates_url=dict(default='https://updates.jenkins-ci.org'),
         url=dict(default='http://localhost:8080'),
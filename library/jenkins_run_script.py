@@ -7,17 +7,21 @@ from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
 
-import traceback
+import base64
+import errno
+import hashlib
+import json
+import os
 import time
-
-try:
-    import jenkins
-    python_jenkins_installed = True
-except ImportError:
-    python_jenkins_installed = False
+import traceback
+from contextlib import contextmanager
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils._text import to_native
+from ansible.module_utils._text import to_bytes, to_native
+from ansible.module_utils.six import string_types
+from ansible.module_utils.six.moves.urllib.parse import quote
+from ansible.module_utils.jenkins_client import (get_jenkins_client, run_script, run_scripts, write_json_cache,
+                                                 JenkinsError, NotFoundError, POOL_SIZE)
 
 
 ANSIBLE_METADATA = {'metadata_version': '1.1',
@@ -34,15 +38,152 @@ version_added: '2.5'
 description:
     - The C(jenkins_run_script) module takes a script plus a dict of values
       to use within the script and returns the result of the script being run.
-requirements:
-  - "python-jenkins >= 0.4.12"
 options:
   script:
     description:
       - The groovy script to be executed.
         This gets passed as a string Template if args is defined.
-    required: true
+      - One of I(script), I(scripts) or I(handle) is required.
+    required: false
     default: null
+  scripts:
+    description:
+      - List of groovy scripts executed one after the other in one request,
+        which saves a round trip and a script console compile per script.
+      - Every script is compiled on its own, so a script that fails doesn't
+        stop the next ones. Their output and errors are returned separately
+        in C(results) and the task fails if any of them failed.
+      - I(args) are substituted in every script.
+      - The scripts are run as with I(structured).
+    type: list
+    elements: str
+    required: false
+  structured:
+    description:
+      - Run the script in a wrapper that returns a JSON envelope, with the
+        value of its last statement in C(result), its printed C(output), the
+        C(exception_class), C(message) and C(error) stack trace if it failed,
+        and its C(duration).
+      - The task fails if the script raised an exception. Without
+        I(structured) the output is searched for a stack trace instead,
+        which can't tell a failed script from one printing a stack trace.
+      - Every script gets a script console of its own, with the same default
+        imports, and the value of its last statement is returned as JSON
+        when it is a string, number, boolean, list or map, as a string
+        otherwise.
+    type: bool
+    required: false
+    default: 'no'
+  cache_ttl:
+    description:
+      - Return the result of the same script run against the same url by the
+        same user in the last I(cache_ttl) seconds instead of running it
+        again. C(0) disables the cache.
+      - Only for read-only scripts, like inventory queries repeated by the
+        hosts of a play. Failed runs are not cached.
+      - Results are cached in C(~/.ansible/tmp/jenkins-script-cache) of the
+        host the module runs on by the hash of the script after the I(args)
+        substitution, up to 32MB, the least recently used are removed first.
+        Tasks asking for the same script wait for the first one, so the
+        script runs once.
+      - "The cache is only shared by the tasks run on the same host, use
+        C(delegate_to: localhost) so that all the hosts of a play run the
+        task on the machine running Ansible."
+    type: int
+    required: false
+    default: 0
+  nodes:
+    description:
+      - Run the script on nodes through their C(computer/<node>/scriptText)
+        script console instead of on the controller.
+      - A list of node names, C(all) for all the agents, or a label
+        expression like C(linux && docker) for the agents matching it.
+        Offline agents found with C(all) or a label are skipped.
+      - The script runs in the agent JVM, where the Jenkins API of the
+        controller isn't available. The output of every node is returned in
+        C(nodes) and the task fails if the script failed on any of them.
+      - Mutually exclusive with I(scripts) and I(structured).
+    type: raw
+    required: false
+  node_workers:
+    description:
+      - Number of nodes the script runs on at the same time with I(nodes).
+    type: int
+    required: false
+    default: 8
+  registered:
+    description:
+      - Compile the script once in Jenkins and keep it by the sha256 of its
+        text, later runs send the hash and the I(args) only. Saves the
+        compile of the script and most of the request for scripts run often.
+      - I(args) aren't substituted in the script text, they are sent as JSON
+        and bound as variables of the script, and as the C(args) map.
+      - A script unknown to Jenkins, after a restart or when dropped from the
+        256 most recently used scripts, is sent and registered again.
+      - Mutually exclusive with I(scripts), I(structured), I(nodes),
+        I(background) and I(handle).
+    type: bool
+    required: false
+    default: 'no'
+  background:
+    description:
+      - Start the script in a thread of Jenkins and poll it with short
+        requests until it is finished, so a long script isn't cut by the
+        I(timeout) of a request or of a proxy in front of Jenkins.
+      - Every poll returns the output printed since the previous one, which
+        is appended to I(output_file) as it comes.
+      - The value of the last statement is returned in C(result) as a string
+        and the task fails if the script raised an exception, as with
+        I(structured).
+      - The script keeps running if the task is interrupted or gives up
+        after I(wait_timeout), pass the returned C(handle) to a later task to
+        wait for it again. Finished scripts nobody asked for are dropped by
+        Jenkins after an hour, and all of them on a restart.
+      - Mutually exclusive with I(scripts), I(nodes), I(structured) and
+        I(cache_ttl).
+    type: bool
+    required: false
+    default: 'no'
+  handle:
+    description:
+      - C(handle) returned by an earlier task with I(background), wait for
+        that script instead of starting one.
+    type: str
+    required: false
+  wait_timeout:
+    description:
+      - Seconds to wait for a script started with I(background), the task
+        fails with its C(handle) when the script is still running after.
+        C(0) returns the C(handle) right after starting the script.
+    type: int
+    required: false
+    default: 3600
+  poll_interval:
+    description:
+      - Initial interval between polls of a background script, sec. It grows
+        by half after each poll, up to I(max_poll_interval).
+    type: float
+    required: false
+    default: 1
+  max_poll_interval:
+    description:
+      - Upper limit of the interval between polls of a background script, sec
+    type: float
+    required: false
+    default: 30
+  output_file:
+    description:
+      - File the output of a background script is appended to while it runs.
+    type: path
+    required: false
+  max_output:
+    description:
+      - Number of characters of the output and the stack trace kept with
+        I(structured) or I(scripts), the rest is dropped in Jenkins and
+        C(truncated) is set. C(0) keeps everything.
+    type: int
+    required: false
+    default: 0
   url:
     description:
       - The jenkins server to execute the script against. The default is a local
@@ -76,11 +217,27 @@ options:
       - The request timeout in seconds
     required: false
     default: 10
+  rate_limit:
+    description:
+      - Requests per second sent to the controller by all the tasks run on
+        the same host together, C(0) is unlimited, see M(jenkins_build).
+    type: float
+    required: false
+    default: 0
+  max_in_flight:
+    description:
+      - Requests sent to the controller at the same time by all the tasks
+        run on the same host together, C(0) is unlimited.
+    type: int
+    required: false
+    default: 0
   args:
     description:
       - A dict of key-value pairs used in formatting the script using string.
         Template (see https://docs.python.org/2/library/string.html#template-strings).
         It's better to use ansible 'template' lookup for script parameter.
+      - With I(registered), the values are bound as variables of the script
+        instead.
     required: false
     default: null
 notes:
@@ -107,6 +264,70 @@ EXAMPLES = '''
     script: "{{ setmaster_mode }}"
     args:
       jenkins_mode: Node.Mode.EXCLUSIVE
+- name: Count the jobs, the value of the script is returned in result
+  jenkins_run_script:
+    script: 'Jenkins.instance.getAllItems(Job.class).size()'
+    structured: true
+    max_output: 65536
+    user: admin
+    password: admin
+  register: job_count
+- name: List the plugins once for all the hosts of the play
+  jenkins_run_script:
+    script: 'println(Jenkins.instance.pluginManager.plugins*.shortName.join(","))'
+    cache_ttl: 300
+    url: http://jenkins.example.com:8080
+    user: admin
+    password: admin
+  delegate_to: localhost
+- name: Check the disk space of all the linux agents
+  jenkins_run_script:
+    script: 'println("df -h /".execute().text)'
+    nodes: linux
+    node_workers: 16
+    user: admin
+    password: admin
+- name: Configure the controller with several scripts in one request
+  jenkins_run_script:
+    scripts:
+      - "{{ lookup('template', 'security.groovy') }}"
+      - "{{ lookup('template', 'executors.groovy') }}"
+      - "{{ lookup('template', 'tools.groovy') }}"
+    user: admin
+    password: admin
+- name: Disable a job from a script compiled once for all the calls
+  jenkins_run_script:
+    script: |
+      def job = Jenkins.instance.getItemByFullName(name)
+      job.disable()
+      println("${job.fullName} disabled")
+    registered: true
+    args:
+      name: "{{ item }}"
+    user: admin
+    password: admin
+  loop: "{{ retired_jobs }}"
+- name: Reindex the artifacts, which takes longer than the proxy timeout
+  jenkins_run_script:
+    script: "{{ lookup('template', 'reindex.groovy') }}"
+    background: true
+    wait_timeout: 7200
+    output_file: /var/log/jenkins-reindex.log
+    user: admin
+    password: admin
+- name: Start a script and wait for it at the end of the play
+  jenkins_run_script:
+    script: "{{ lookup('template', 'cleanup.groovy') }}"
+    background: true
+    wait_timeout: 0
+    user: admin
+    password: admin
+  register: cleanup
+- name: Wait for the script started earlier
+  jenkins_run_script:
+    handle: "{{ cleanup.handle }}"
+    user: admin
+    password: admin
 - name: interacting with an untrusted HTTPS connection
   jenkins_run_script:
     script: "println(Jenkins.instance.pluginManager.plugins)"
@@ -122,15 +343,283 @@ output:
     returned: success
     type: string
     sample: 'Result: true'
+result:
+    description: Value of the last statement of the script, a string with I(background).
+    returned: success, when I(structured) or I(background) is used
+    type: raw
+    sample: 42
+truncated:
+    description: True if the output was cut to I(max_output) characters.
+    returned: success, when I(structured) is used
+    type: bool
+exception_class:
+    description: Class of the exception raised by the script, C(message) and C(error) hold its message and stack trace.
+    returned: failure, when I(structured) or I(background) is used
+    type: str
+    sample: groovy.lang.MissingPropertyException
+duration:
+    description: Run time of the script in Jenkins in seconds.
+    returned: success, when I(structured) or I(background) is used
+    type: float
+nodes:
+    description:
+      - Output of the script on every node of I(nodes), with its C(error) if
+        it failed and its C(duration) in seconds. Offline agents are
+        C(skipped).
+    returned: success, when I(nodes) is used
+    type: list
+    sample: >
+      [{u'name': u'agent-01', u'output': u'/dev/sda1 50G 12G 38G 24% /\\n', u'failed': False,
+      u'skipped': False, u'error': None, u'duration': 0.084}]
+handle:
+    description: Id of the script started with I(background), to wait for it with I(handle).
+    returned: when I(background) or I(handle) is used
+    type: str
+    sample: 0c6f3f0e-3d1b-4c55-9a8e-54d1e8f5b2a7
+script_id:
+    description: Sha256 of the script text the script is registered by.
+    returned: success, when I(registered) is used
+    type: str
+    sample: 9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08
+cached:
+    description: True if the result was taken from the cache.
+    returned: success, when I(cache_ttl) is used
+    type: bool
+results:
+    description:
+      - Result of every script of I(scripts), with the keys returned for a
+        single script with I(structured).
+    returned: success, when I(scripts) is used
+    type: list
+    sample: >
+      [{u'output': u'Security realm set\\n', u'result': None, u'truncated': False, u'failed': False,
+      u'exception_class': None, u'message': None, u'error': None, u'duration': 0.012}]
 '''
 
 
+COMPUTERS = 'computer/api/json?tree=computer[displayName,offline]'
+LABEL_NODES = 'label/%s/api/json?tree=nodes[nodeName]'
+NODE_SCRIPT_TEXT = 'computer/%s/scriptText'
+CONTROLLER_COMPUTER = 'hudson.model.Hudson$MasterComputer'
+# Background scripts are kept in a map of the servlet context of Jenkins, which
+# outlives the script console requests
+BACKGROUND_JOBS = 'ansible.jenkins_run_script.jobs'
+# Starts the script in a thread running as the user and prints its id
+BACKGROUND_START = '''
+import hudson.security.ACL
+import java.util.concurrent.ConcurrentHashMap
+import org.codehaus.groovy.control.CompilerConfiguration
+import org.codehaus.groovy.control.customizers.ImportCustomizer
+
+def context = Jenkins.instance.servletContext
+def jobs
+synchronized (context) {
+    jobs = context.getAttribute('%(jobs)s')
+    if (jobs == null) {
+        jobs = new ConcurrentHashMap()
+        context.setAttribute('%(jobs)s', jobs)
+    }
+}
+// Forget the scripts finished an hour ago that nobody asked for
+def now = System.currentTimeMillis()
+jobs.entrySet().removeAll { it.value.finished != null && it.value.finished < now - 3600000 }
+
+def config = new CompilerConfiguration()
+config.addCompilationCustomizers(new ImportCustomizer().addStarImports('jenkins', 'jenkins.model', 'hudson', 'hudson.model'))
+def output = new StringWriter()
+def shell = new GroovyShell(Jenkins.instance.pluginManager.uberClassLoader,
+                            new Binding(out: new PrintWriter(output, true)), config)
+def source = new String('%(script)s'.decodeBase64(), 'UTF-8')
+def id = UUID.randomUUID().toString()
+def job = new ConcurrentHashMap([output: output, started: now])
+def auth = Jenkins.getAuthentication()
+def thread = new Thread({
+    def acl = ACL.as(auth)
+    try {
+        def value = shell.evaluate(source)
+        if (value != null) {
+            job.result = String.valueOf(value)
+        }
+    } catch (Throwable e) {
+        def trace = new StringWriter()
+        e.printStackTrace(new PrintWriter(trace))
+        job.putAll(exception: e.getClass().name, message: String.valueOf(e.message), error: trace.toString())
+    } finally {
+        acl.close()
+        job.finished = System.currentTimeMillis()
+    }
+} as Runnable, 'ansible jenkins_run_script ' + id)
+thread.daemon = true
+jobs.put(id, job)
+thread.start()
+println(id)
+'''
+# Registered scripts are compiled once into a script class kept by the hash of
+# their text in a map of the servlet context, the least recently used are
+# dropped past REGISTRY_SIZE
+REGISTRY = 'ansible.jenkins_run_script.registry'
+REGISTRY_SIZE = 256
+REGISTERED_MISSING = 'jenkins_run_script: no registered script %s'
+REGISTERED_IMPORTS = '''
+import groovy.json.JsonSlurper
+import org.codehaus.groovy.control.CompilerConfiguration
+import org.codehaus.groovy.control.customizers.ImportCustomizer
+import org.codehaus.groovy.runtime.InvokerHelper
+'''
+# Looks up the script class of a registered script
+REGISTERED_LOOKUP = '''
+def registry = Jenkins.instance.servletContext.getAttribute('%(registry)s')
+'''
+# Compiles the script and registers its class
+REGISTERED_INSTALL = '''
+def context = Jenkins.instance.servletContext
+def registry
+synchronized (context) {
+    registry = context.getAttribute('%(registry)s')
+    if (registry == null) {
+        registry = Collections.synchronizedMap(new LinkedHashMap(64, 0.75f, true) {
+            protected boolean removeEldestEntry(Map.Entry eldest) {
+                size() > %(size)d
+            }
+        })
+        context.setAttribute('%(registry)s', registry)
+    }
+}
+if (registry.get('%(id)s') == null) {
+    def config = new CompilerConfiguration()
+    config.addCompilationCustomizers(new ImportCustomizer().addStarImports('jenkins', 'jenkins.model', 'hudson', 'hudson.model'))
+    def shell = new GroovyShell(Jenkins.instance.pluginManager.uberClassLoader, config)
+    def source = new String('%(script)s'.decodeBase64(), 'UTF-8')
+    registry.put('%(id)s', shell.parse(source, 'Registered_%(name)s').getClass())
+}
+'''
+# Runs a new instance of the registered script class with the args bound as
+# variables and in args
+REGISTERED_RUN = '''
+def compiled = registry?.get('%(id)s')
+if (compiled == null) {
+    println('%(missing)s')
+} else {
+    def args = new JsonSlurper().parseText(new String('%(args)s'.decodeBase64(), 'UTF-8'))
+    def binding = new Binding(new HashMap(args))
+    binding.setVariable('args', args)
+    binding.setVariable('out', out)
+    InvokerHelper.createScript(compiled, binding).run()
+}
+'''
+# Prints the state of a background script and its output from offset as JSON,
+# a finished script is forgotten once its state is read
+BACKGROUND_STATUS = '''
+import groovy.json.JsonOutput
+
+def jobs = Jenkins.instance.servletContext.getAttribute('%(jobs)s')
+def job = jobs?.get('%(id)s')
+def state = [found: job != null]
+if (job != null) {
+    // Read before the output, all of it is there once the script is finished
+    def finished = job.finished
+    def text = job.output.toString()
+    state.putAll(finished: finished != null, output: text.length() > %(offset)d ? text.substring(%(offset)d) : '',
+                 offset: text.length(), result: job.result, exception: job.exception, message: job.message,
+                 error: job.error, duration: (finished ?: System.currentTimeMillis()) - job.started)
+    if (finished != null) {
+        jobs.remove('%(id)s')
+    }
+}
+println(JsonOutput.toJson(state))
+'''
+# Size of the cached script results on disk, the least recently used are
+# removed above it, bytes
+SCRIPT_CACHE_SIZE = 32 * 1024 * 1024
+# Tasks missing the same entry wait for each other on one of these lock files
+SCRIPT_CACHE_LOCKS = 64
+
+
+class ScriptCache:
+    """Results of read-only scripts, kept on disk for I(cache_ttl) seconds.
+
+    An entry is a file named after the hash of the url, user and rendered
+    scripts. Reading an entry touches it, the least recently used entries
+    are removed once the cache grows over SCRIPT_CACHE_SIZE. The tasks of a
+    play missing the same entry wait for the first one to run the script.
+    """
+
+    def __init__(self, module, ttl, key):
+        self.module = module
+        self.ttl = ttl
+        self.dir = os.path.expanduser('~/.ansible/tmp/jenkins-script-cache')
+        digest = hashlib.sha256(to_bytes(json.dumps(key, sort_keys=True))).hexdigest()
+        self.path = os.path.join(self.dir, '%s.json' % digest)
+        self.lock_path = os.path.join(self.dir, 'lock-%02d' % (int(digest[:8], 16) % SCRIPT_CACHE_LOCKS))
+
+    @contextmanager
+    def lock(self):
+        import fcntl
+        try:
+            try:
+                os.makedirs(self.dir, int('0700', 8))
+            except OSError as e:
+                # Other tasks of the play create it at the same time
+                if e.errno != errno.EEXIST:
+                    raise
+            f = open(self.lock_path, 'a')
+        except (IOError, OSError) as e:
+            self.module.warn('Unable to lock script cache %s, %s' % (self.lock_path, to_native(e)))
+            yield
+            return
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+        finally:
+            f.close()
+
+    def get(self):
+        """Return the cached result, None if there is none younger than the ttl."""
+        try:
+            with open(self.path) as f:
+                entry = json.load(f)
+            if time.time() - entry['time'] >= self.ttl:
+                return None
+            os.utime(self.path, None)
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        return entry['result']
+
+    def save(self, result):
+        try:
+            write_json_cache(self.path, dict(time=time.time(), result=result))
+            self.evict()
+        except (IOError, OSError) as e:
+            self.module.warn('Unable to save script cache %s, %s' % (self.path, to_native(e)))
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.dir):
+            if name.endswith('.json'):
+                path = os.path.join(self.dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, path in sorted(entries):
+            if size <= SCRIPT_CACHE_SIZE:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= entry_size
+
+
 class JenkinsScript:
 
     def __init__(self, module):
         self.module = module
 
         self.script = module.params.get('script')
+        self.scripts = module.params.get('scripts')
         self.url = module.params.get('url')
         self.validate_certs = module.params.get('validate_certs')
         self.user = module.params.get('user')
@@ -138,37 +627,249 @@ class JenkinsScript:
         self.token = module.params.get('token')
         self.timeout = module.params.get('timeout')
         self.args = module.params.get('args')
+        self.structured = module.params.get('structured')
+        self.max_output = module.params.get('max_output')
+        self.cache_ttl = module.params.get('cache_ttl')
+        self.nodes = module.params.get('nodes')
+        self.node_workers = module.params.get('node_workers')
+        self.background = module.params.get('background')
+        self.handle = module.params.get('handle')
+        self.wait_timeout = module.params.get('wait_timeout')
+        self.poll_interval = module.params.get('poll_interval')
+        self.max_poll_interval = module.params.get('max_poll_interval')
+        self.output_file = module.params.get('output_file')
+        self.registered = module.params.get('registered')
 
-        self.server = self.get_jenkins_connection()
+        self.client = get_jenkins_client(module, max(POOL_SIZE, self.node_workers))
 
         self.result = {
             'output': ''
         }
 
-    def get_jenkins_connection(self):
+    def render(self, script):
+        if self.args is not None and not self.registered:
+            from string import Template
+            return Template(script).substitute(self.args)
+        return script
+
+    def run_structured(self, scripts):
+        """Run the scripts through the JSON envelope, return their results."""
         try:
-            if (self.user and self.password):
-                return jenkins.Jenkins(self.url, self.user, self.password, self.timeout)
-            elif (self.user and self.token):
-                return jenkins.Jenkins(self.url, self.user, self.token, self.timeout)
-            elif (self.user and not (self.password or self.token)):
-                return jenkins.Jenkins(self.url, self.user, timeout=self.timeout)
-            else:
-                return jenkins.Jenkins(self.url, timeout=self.timeout)
+            results = run_scripts(self.client, scripts, self.max_output)
         except Exception as e:
-            self.module.fail_json(msg='Unable to connect to Jenkins server, %s' % to_native(e),
+            self.module.fail_json(msg='Fail to run script, %s' % to_native(e),
                                   exception=traceback.format_exc())
+        return [dict(output=entry['output'], truncated=entry['truncated'], result=entry['result'],
+                     failed=entry['exception'] is not None, exception_class=entry['exception'],
+                     message=entry['message'], error=entry['error'], duration=entry['duration'] / 1000.0)
+                for entry in results]
+
+    def run_scripts(self):
+        result = self.result
+        scripts = [self.render(script) for script in self.scripts]
+        result['results'] = []
+        if self.module.check_mode:
+            return result
+        results = result['results'] = self.run_structured(scripts)
+        result['output'] = ''.join(entry['output'] for entry in results)
+        failed = ['#%d' % (index + 1) for index, entry in enumerate(results) if entry['failed']]
+        if failed:
+            self.module.fail_json(msg='%d of %d scripts failed with stacktrace: %s' % (
+                                  len(failed), len(results), ', '.join(failed)), **result)
+        return result
 
     def run_script(self):
+        if not self.cache_ttl:
+            return self.execute()
+        scripts = [self.render(script) for script in self.scripts or [self.script]]
+        cache = ScriptCache(self.module, self.cache_ttl,
+                            dict(url=self.url.rstrip('/'), user=self.user, scripts=scripts, batch=bool(self.scripts),
+                                 structured=self.structured, max_output=self.max_output, nodes=self.nodes,
+                                 args=self.args if self.registered else None))
+        with cache.lock():
+            cached = cache.get()
+            if cached is not None:
+                self.result.update(cached, cached=True)
+                return self.result
+            result = self.execute()
+            if not self.module.check_mode:
+                cache.save(result)
+        result['cached'] = False
+        return result
+
+    def find_nodes(self):
+        """Return the names of the nodes to run the script on, and of the agents skipped as offline."""
+        if not isinstance(self.nodes, string_types):
+            return [to_native(node) for node in self.nodes], []
+        try:
+            computers = self.client.get_json(COMPUTERS).get('computer') or []
+            agents = dict((computer['displayName'], computer.get('offline')) for computer in computers
+                          if computer.get('_class') != CONTROLLER_COMPUTER)
+            if self.nodes != 'all':
+                label = self.client.get_json(LABEL_NODES % quote(to_bytes(self.nodes), safe=''))
+                names = set(node.get('nodeName') for node in label.get('nodes') or [])
+                agents = dict((name, offline) for name, offline in agents.items() if name in names)
+        except NotFoundError:
+            self.module.fail_json(msg='No label %s in Jenkins' % self.nodes)
+        except Exception as e:
+            self.module.fail_json(msg='Unable to list the nodes, %s' % to_native(e),
+                                  exception=traceback.format_exc())
+        return (sorted(name for name, offline in agents.items() if not offline),
+                sorted(name for name, offline in agents.items() if offline))
+
+    def run_on_node(self, name, script):
+        started = time.time()
+        error = None
+        try:
+            output = run_script(self.client, script, NODE_SCRIPT_TEXT % quote(to_bytes(name), safe=''))
+            if 'Exception:' in output and 'at java.lang.Thread' in output:
+                error = 'script failed with stacktrace'
+        except JenkinsError as e:
+            output = ''
+            error = to_native(e)
+        return dict(name=name, output=output, failed=error is not None, skipped=False, error=error,
+                    duration=round(time.time() - started, 3))
+
+    def run_nodes(self):
+        """Run the script on the nodes from a pool of I(node_workers) threads."""
         result = self.result
-        if self.args is not None:
-            from string import Template
-            script_contents = Template(self.script).substitute(self.args)
-        else:
-            script_contents = self.script
-        if not self.module.check_mode:
+        script = self.render(self.script)
+        nodes, offline = self.find_nodes()
+        result['nodes'] = []
+        if self.module.check_mode:
+            return result
+        if nodes:
+            # Imported here, multiprocessing takes long to import and most runs use one node
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(min(self.node_workers, len(nodes)))
+            try:
+                result['nodes'] = pool.map(lambda name: self.run_on_node(name, script), nodes)
+            finally:
+                pool.close()
+        result['nodes'].extend(dict(name=name, output='', failed=False, skipped=True, error='Agent is offline',
+                                    duration=0) for name in offline)
+        failed = [node['name'] for node in result['nodes'] if node['failed']]
+        if failed:
+            self.module.fail_json(msg='Script failed on %d of %d nodes: %s' % (len(failed), len(nodes),
+                                                                            ', '.join(failed)), **result)
+        return result
+
+    def start_background(self, script):
+        """Start the script in a thread of Jenkins, return its id."""
+        try:
+            return run_script(self.client, BACKGROUND_START % dict(
+                jobs=BACKGROUND_JOBS, script=to_native(base64.b64encode(to_bytes(script))))).strip()
+        except Exception as e:
+            self.module.fail_json(msg='Fail to start script, %s' % to_native(e),
+                                  exception=traceback.format_exc())
+
+    def poll_background(self, handle, offset):
+        try:
+            state = json.loads(run_script(self.client, BACKGROUND_STATUS % dict(
+                jobs=BACKGROUND_JOBS, id=handle, offset=offset)).strip().split('\n')[-1])
+        except Exception as e:
+            self.module.fail_json(msg='Fail to poll script %s, %s' % (handle, to_native(e)), handle=handle,
+                                  exception=traceback.format_exc())
+        if not state['found']:
+            self.module.fail_json(msg='No background script %s in Jenkins, it was already collected or '
+                                      'Jenkins was restarted' % handle, handle=handle)
+        return state
+
+    def run_background(self):
+        """Run the script in Jenkins apart from the requests and poll it until it is finished.
+
+        Each poll returns the output printed since the previous one, which is
+        appended to I(output_file). The interval grows from I(poll_interval)
+        up to I(max_poll_interval).
+        """
+        result = self.result
+        handle = self.handle
+        if self.module.check_mode:
+            return result
+        if handle is None:
+            handle = self.start_background(self.render(self.script))
+        result['handle'] = handle
+        if not self.wait_timeout:
+            return result
+        deadline = time.time() + self.wait_timeout
+        interval = self.poll_interval
+        offset = 0
+        chunks = []
+        log = None
+        if self.output_file:
+            try:
+                log = open(self.output_file, 'a')
+            except (IOError, OSError) as e:
+                self.module.fail_json(msg='Unable to write output file %s, %s' % (self.output_file, to_native(e)),
+                                      handle=handle, exception=traceback.format_exc())
+        try:
+            while True:
+                state = self.poll_background(handle, offset)
+                offset = state['offset']
+                if state['output']:
+                    chunks.append(state['output'])
+                    if log is not None:
+                        log.write(state['output'])
+                        log.flush()
+                if state['finished']:
+                    break
+                if time.time() + interval > deadline:
+                    result['output'] = ''.join(chunks)
+                    self.module.fail_json(msg='Script %s still running after %d seconds, wait for it again with '
+                                              'handle' % (handle, self.wait_timeout), **result)
+                time.sleep(interval)
+                interval = min(interval * 1.5, self.max_poll_interval)
+        finally:
+            if log is not None:
+                log.close()
+        result.update(output=''.join(chunks), result=state['result'], exception_class=state['exception'],
+                      message=state['message'], error=state['error'], duration=state['duration'] / 1000.0)
+        if state['exception'] is not None:
+            self.module.fail_json(msg='script failed with %s: %s' % (state['exception'], state['message']),
+                                  **result)
+        return result
+
+    def run_registered(self, script):
+        """Run a registered script with the args, register it first if Jenkins doesn't know it yet.
+
+        The script is known by the sha256 of its text, so a registered script
+        is only sent again after a restart of Jenkins or when it was dropped
+        from the registry.
+        """
+        script_id = hashlib.sha256(to_bytes(script)).hexdigest()
+        params = dict(registry=REGISTRY, size=REGISTRY_SIZE, id=script_id, name=script_id[:16],
+                      missing=REGISTERED_MISSING % script_id,
+                      args=to_native(base64.b64encode(to_bytes(json.dumps(self.args or {})))))
+        self.result['script_id'] = script_id
+        output = run_script(self.client, (REGISTERED_IMPORTS + REGISTERED_LOOKUP + REGISTERED_RUN) % params)
+        if output.strip() == params['missing']:
+            params['script'] = to_native(base64.b64encode(to_bytes(script)))
+            output = run_script(self.client, (REGISTERED_IMPORTS + REGISTERED_INSTALL + REGISTERED_RUN) % params)
+        return output
+
+    def execute(self):
+        result = self.result
+        if self.background or self.handle:
+            return self.run_background()
+        if self.nodes:
+            return self.run_nodes()
+        if self.scripts:
+            return self.run_scripts()
+        script_contents = self.render(self.script)
+        if self.structured:
+            if not self.module.check_mode:
+                # failed and exception are kept by Ansible for the task status and traceback
+                entry = self.run_structured([script_contents])[0]
+                result.update((key, value) for key, value in entry.items() if key != 'failed')
+                if entry['failed']:
+                    self.module.fail_json(msg='script failed with %s: %s' % (entry['exception_class'],
+                                                                             entry['message']), **result)
+        elif not self.module.check_mode:
             try:
-                result['output'] = self.server.run_script(script_contents)
+                if self.registered:
+                    result['output'] = self.run_registered(script_contents)
+                else:
+                    result['output'] = run_script(self.client, script_contents)
                 if 'Exception:' in result['output'] and 'at java.lang.Thread' in result['output']:
                     self.module.fail_json(msg="script failed with stacktrace:\n" + result['output'])
             except Exception as e:
@@ -177,31 +878,59 @@ class JenkinsScript:
         return result
 
 
-def test_dependencies(module):
-    if not python_jenkins_installed:
-        module.fail_json(msg="python-jenkins required for this module. "
-                         "see http://python-jenkins.readthedocs.io/en/latest/install.html")
-
-
 def main():
     module = AnsibleModule(
         argument_spec=dict(
-            script=dict(required=True, type="str"),
+            script=dict(required=False, type="str"),
+            scripts=dict(required=False, type="list", elements="str"),
             url=dict(required=False, type="str", default="http://localhost:8080"),
             validate_certs=dict(required=False, type="bool", default=True),
             user=dict(required=False, type="str", default=None),
             password=dict(required=False, no_log=True, type="str", default=None),
             token=dict(required=False, no_log=True),
             timeout=dict(required=False, type="int", default=10),
-            args=dict(required=False, type="dict", default=None)
+            rate_limit=dict(required=False, default=0, type='float'),
+            max_in_flight=dict(required=False, default=0, type='int'),
+            args=dict(required=False, type="dict", default=None),
+            structured=dict(required=False, type="bool", default=False),
+            max_output=dict(required=False, type="int", default=0),
+            cache_ttl=dict(required=False, type="int", default=0),
+            nodes=dict(required=False, type="raw", default=None),
+            node_workers=dict(required=False, type="int", default=8),
+            background=dict(required=False, type="bool", default=False),
+            handle=dict(required=False, type="str", default=None),
+            wait_timeout=dict(required=False, type="int", default=3600),
+            poll_interval=dict(required=False, type="float", default=1),
+            max_poll_interval=dict(required=False, type="float", default=30),
+            output_file=dict(required=False, type="path", default=None),
+            registered=dict(required=False, type="bool", default=False)
         ),
         mutually_exclusive=[
             ['password', 'token'],
+            ['script', 'scripts'],
+            ['nodes', 'scripts'],
+            ['nodes', 'structured'],
+            ['background', 'scripts'],
+            ['background', 'nodes'],
+            ['background', 'cache_ttl'],
+            ['handle', 'script'],
+            ['handle', 'scripts'],
+            ['handle', 'nodes'],
+            ['handle', 'cache_ttl'],
+            ['background', 'structured'],
+            ['handle', 'structured'],
+            ['registered', 'scripts'],
+            ['registered', 'structured'],
+            ['registered', 'nodes'],
+            ['registered', 'background'],
+            ['registered', 'handle'],
+        ],
+        required_one_of=[
+            ['script', 'scripts', 'handle'],
         ],
         supports_check_mode=True,
     )
 
-    test_dependencies(module)
     jenkins_script = JenkinsScript(module)
 
     result = jenkins_script.run_script()
@@ -0,0 +1,812 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright: (c) Ansible Project
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+#
+# Helpers shared by the jenkins_build and jenkins_build_wait modules to follow
+# queued and running builds.
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import base64
+import json
+import os
+import re
+import traceback
+import time
+from collections import deque
+from contextlib import contextmanager
+from fnmatch import fnmatch
+from ansible.module_utils._text import to_bytes, to_native
+from ansible.module_utils.six.moves.urllib.parse import quote
+from ansible.module_utils.jenkins_client import JenkinsError, HTTPError, NotFoundError, TransportError, job_url, run_script
+
+QUEUE_ITEM = 'queue/item/%(number)d/api/json?tree=executable[number,url],cancelled,why'
+BUILD_INFO = '%(folder_url)sjob/%(short_name)s/%(number)d/api/json?tree=%(tree)s'
+ARTIFACT = '%(folder_url)sjob/%(short_name)s/%(number)d/artifact/%(path)s'
+DOWNSTREAM_BUILDS = '%(folder_url)sjob/%(short_name)s/%(number)d/api/json?tree=actions[downstreamBuilds[jobFullName,buildNumber]]'
+DOWNSTREAM_PROJECTS = '%(folder_url)sjob/%(short_name)s/api/json?tree=fullName,downstreamProjects[fullName]'
+UPSTREAM_CAUSES = '%(folder_url)sjob/%(short_name)s/api/json?tree=builds[number,actions[causes[upstreamProject,upstreamBuild]]]{0,%(limit)d}'
+QUEUE_CAUSES = 'queue/api/json?tree=items[id,task[fullName],actions[causes[upstreamProject,upstreamBuild]]]'
+JOB_BUILDS = '%(folder_url)sjob/%(short_name)s/api/json?tree=builds[number,url,queueId]{0,%(limit)d}'
+PROGRESSIVE_TEXT = '%(folder_url)sjob/%(short_name)s/%(number)d/logText/progressiveText?start=%(start)d'
+CONSOLE_TEXT = '%(folder_url)sjob/%(short_name)s/%(number)d/consoleText'
+CONTENT_RANGE = re.compile(r'bytes\s+(\d+)-\d+/(\d+|\*)\s*$')
+
+# Keys returned by the build api at depth 0, without 'actions'
+BUILD_INFO_FIELDS = ['artifacts[*]', 'building', 'builtOn', 'changeSet[*[*]]', 'changeSets[*[*]]',
+                     'culprits[*]', 'description', 'displayName', 'duration', 'estimatedDuration',
+                     'executor[*]', 'fullDisplayName', 'id', 'inProgress', 'keepLog',
+                     'nextBuild[number,url]', 'number', 'previousBuild[number,url]', 'queueId',
+                     'result', 'timestamp', 'url']
+# Keys needed to follow a running build
+BUILD_POLL_FIELDS = ['building', 'estimatedDuration', 'timestamp']
+# Waits in Jenkins until the builds are finished or the time is up, and prints
+# their state as a JSON list. Builds are passed base64 encoded, job names may
+# contain quotes.
+SERVER_WAIT_SCRIPT = '''
+import groovy.json.JsonOutput
+import groovy.json.JsonSlurper
+import hudson.model.Queue
+
+def states = new JsonSlurper().parseText(new String('%(builds)s'.decodeBase64(), 'UTF-8'))
+def deadline = System.currentTimeMillis() + %(wait)d
+def jenkins = Jenkins.instance
+
+def runOf = { state ->
+    def job = jenkins.getItemByFullName(state.name)
+    if (state.number != null) {
+        return job?.getBuildByNumber(state.number as int)
+    }
+    def item = jenkins.queue.getItem(state.queue_id as long)
+    if (item instanceof Queue.LeftItem) {
+        if (item.isCancelled()) {
+            state.cancelled = true
+            state.building = false
+            return null
+        }
+        def run = item.getExecutable()
+        if (run != null) {
+            state.queue_time = run.getStartTimeInMillis() - item.getInQueueSince()
+        }
+        return run
+    }
+    if (item != null) {
+        return null
+    }
+    def run = job?.builds?.limit(%(recent)d)?.find { it.queueId == state.queue_id }
+    if (run == null) {
+        state.lost = true
+        state.building = false
+    }
+    return run
+}
+
+while (true) {
+    states.findAll { it.building }.each { state ->
+        def run = runOf(state)
+        if (run != null) {
+            state.number = run.number
+            state.building = run.isBuilding()
+            state.duration = state.building ? null : run.getDuration()
+        }
+    }
+    if (!states.any { it.building } || System.currentTimeMillis() >= deadline) {
+        break
+    }
+    sleep(%(interval)d)
+}
+println(JsonOutput.toJson(states))
+'''
+# Seconds a server side wait blocks, proxies in front of Jenkins often close
+# requests idle for a minute
+SERVER_WAIT_SLICE = 50
+# Milliseconds between checks of the builds in the server side wait
+SERVER_WAIT_INTERVAL = 500
+
+
+def get_json(client, url_format, variables):
+    return client.get_json(url_format % variables)
+
+
+def get_job_json(client, url_format, name, **variables):
+    return client.get_json(job_url(url_format, name, **variables))
+
+
+def content_range(response):
+    """Return the first byte of a partial response and the size of the whole body, -1 if unknown.
+
+    The first byte is None when the Content-Range header is missing or malformed.
+    """
+    match = CONTENT_RANGE.match(response.header('Content-Range') or '')
+    if match is None:
+        return None, -1
+    return int(match.group(1)), -1 if match.group(2) == '*' else int(match.group(2))
+
+
+def get_build_json(client, name, number, fields):
+    return get_job_json(client, BUILD_INFO, name, number=number, tree=','.join(fields))
+
+
+class Metrics:
+    """Time spent in the phases of the module and the HTTP requests it sent.
+
+    Requests are counted by the client, so the ones it sends on its own, like
+    the crumb, are counted too.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.started = time.time()
+        self.phases = {}
+        self.poll_iterations = 0
+
+    @contextmanager
+    def measure(self, phase):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases[phase] = round(self.phases.get(phase, 0) + time.time() - start, 3)
+
+    def result(self, builds):
+        queue_times = [build['queue'].latency for build in builds if build['queue'].latency is not None]
+        build_times = [build['finished'] - build['started_at'] for build in builds
+                       if build.get('finished') and build.get('started_at')]
+        result = dict(('%s_time' % phase, duration) for phase, duration in self.phases.items())
+        result.update(total_time=round(time.time() - self.started, 3),
+                      queue_time=max(queue_times) if queue_times else None,
+                      build_time=round(max(build_times), 3) if build_times else None,
+                      requests=sum(self.client.requests.values()),
+                      requests_by_endpoint=self.client.requests,
+                      bytes_received=self.client.bytes_received,
+                      poll_iterations=self.poll_iterations)
+        return result
+
+
+class PollScheduler:
+    """Decide when a running build has to be polled again.
+
+    While the build is far from its estimated end most of the remaining time
+    is slept at once, past that point the interval grows exponentially from
+    I(poll_interval) up to I(max_poll_interval).
+    """
+
+    def __init__(self, interval, max_interval, factor=2):
+        self.interval = interval
+        self.max_interval = max_interval
+        self.factor = factor
+
+    def reset(self, build):
+        build['interval'] = self.interval
+
+    def next_delay(self, build, build_info):
+        estimated = build_info.get('estimatedDuration') or -1
+        if estimated > 0 and build_info.get('timestamp'):
+            remaining = (build_info['timestamp'] + estimated) / 1000.0 - time.time()
+            # Jenkins clock may be ahead of ours, never expect more than the whole estimate
+            remaining = min(remaining, estimated / 1000.0)
+            if remaining > build['interval']:
+                self.reset(build)
+                return max(remaining * 0.8, build['interval'])
+        delay = build['interval']
+        build['interval'] = min(build['interval'] * self.factor, self.max_interval)
+        return delay
+
+
+class QueueItemResolver:
+    """Follow a queue item until Jenkins starts a build for it or cancels it.
+
+    Only the fields needed to resolve the item are requested, and the interval
+    between polls grows from I(poll_interval) up to I(max_poll_interval).
+    """
+
+    # Number of recent builds searched for a queue item Jenkins has already forgotten
+    RECENT_BUILDS = 100
+
+    def __init__(self, client, name, queue_id, interval, max_interval, factor=1.5):
+        self.client = client
+        self.name = name
+        self.queue_id = queue_id
+        self.interval = interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.submitted = time.time()
+        self.latency = None
+        self.number = None
+        self.url = None
+        self.cancelled = False
+        self.why = None
+
+    def poll(self):
+        """Return True once the item has left the queue."""
+        try:
+            item = get_json(self.client, QUEUE_ITEM, {'number': self.queue_id})
+        except NotFoundError:
+            # Jenkins drops queue items a few minutes after their build started
+            return self.find_build()
+        self.why = item.get('why')
+        executable = item.get('executable') or {}
+        if item.get('cancelled'):
+            self.cancelled = True
+        elif executable.get('number') is not None:
+            self.number = executable['number']
+            self.url = executable.get('url')
+        else:
+            return False
+        self.latency = round(time.time() - self.submitted, 3)
+        return True
+
+    def find_build(self):
+        job = get_job_json(self.client, JOB_BUILDS, self.name, limit=self.RECENT_BUILDS)
+        for build in job.get('builds') or []:
+            if build.get('queueId') == self.queue_id:
+                self.number = build['number']
+                self.url = build.get('url')
+                self.latency = round(time.time() - self.submitted, 3)
+                return True
+        raise JenkinsError('queue item %d of %s not found in the queue nor in the builds'
+                           % (self.queue_id, self.name))
+
+    def next_delay(self):
+        delay = self.interval
+        self.interval = min(self.interval * self.factor, self.max_interval)
+        return delay
+
+    def info(self):
+        return dict(id=self.queue_id, why=self.why, cancelled=self.cancelled,
+                    wait_time=self.latency)
+
+
+class ConsoleStreamer:
+    """Copy the console log of a running build into a file with logText/progressiveText.
+
+    Only the new part of the log is requested on every poll and it is
+    streamed to the file in chunks of READ_SIZE, so a large log is never held
+    in memory. The first C(head) and the last C(tail) lines are kept for the
+    task result.
+    """
+
+    # Poll more often when the log grows faster than this many bytes per poll
+    CHUNK_SIZE = 1024 * 1024
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, client, name, number, path, head, tail, interval, max_interval):
+        self.client = client
+        self.name = name
+        self.number = number
+        self.path = path
+        self.head_size = head
+        self.head = []
+        self.tail = deque(maxlen=tail)
+        self.lines = 0
+        self.partial = b''
+        self.offset = 0
+        self.min_interval = interval
+        self.interval = interval
+        self.max_interval = max_interval
+        self.log = open(path, 'wb')
+
+    def fetch(self):
+        """Append the new part of the log to the file, return True while the log is still growing."""
+        response = self.client.open('GET', job_url(PROGRESSIVE_TEXT, self.name, number=self.number,
+                                                   start=self.offset), stream=True)
+        size = 0
+        try:
+            for chunk in response.iter_content(self.READ_SIZE):
+                self.log.write(chunk)
+                self.add_lines(chunk)
+                size += len(chunk)
+        finally:
+            response.close()
+        self.offset = int(response.header('X-Text-Size', self.offset + size))
+        if size > self.CHUNK_SIZE:
+            self.interval = max(self.interval / 2, self.min_interval)
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        if response.header('X-More-Data') == 'true':
+            return True
+        self.close()
+        return False
+
+    def add_lines(self, chunk):
+        lines = (self.partial + chunk).split(b'\n')
+        self.partial = lines.pop()
+        for line in lines:
+            self.lines += 1
+            if len(self.head) < self.head_size:
+                self.head.append(line)
+            else:
+                self.tail.append(line)
+
+    def close(self):
+        if not self.log.closed:
+            self.log.close()
+        if self.partial:
+            self.add_lines(b'\n')
+
+    def next_delay(self):
+        return self.interval
+
+    def output(self):
+        """Return the head and tail window of the log."""
+        lines = list(self.head)
+        skipped = self.lines - len(self.head) - len(self.tail)
+        if skipped:
+            lines.append(to_bytes('... %d lines skipped, see %s ...' % (skipped, self.path)))
+        lines.extend(self.tail)
+        return to_native(b'\n'.join(lines), errors='surrogate_or_replace')
+
+
+class ArtifactFetcher:
+    """Download the artifacts of a build matching glob patterns, several at a time.
+
+    Files are streamed to disk in chunks. The url of a downloaded artifact is
+    kept next to it in a hidden C(.<name>.source) file, an existing file of
+    the same build and size is not downloaded again. An interrupted download
+    left in the C(.<number>.part) file of the build is resumed with an HTTP
+    Range request, those of other builds are removed.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, client, patterns, workers, retries=3):
+        self.client = client
+        self.patterns = patterns
+        self.workers = workers
+        self.retries = retries
+
+    def fetch(self, name, number, dest):
+        build = get_build_json(self.client, name, number, ['artifacts[relativePath]'])
+        paths = [artifact['relativePath'] for artifact in build.get('artifacts') or []
+                 if any(fnmatch(artifact['relativePath'], pattern) for pattern in self.patterns)]
+        if not paths:
+            return []
+        # Imported here, multiprocessing takes long to import and most runs don't fetch artifacts
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(self.workers, len(paths)))
+        try:
+            return pool.map(lambda path: self.download(name, number, path, dest), paths)
+        finally:
+            pool.close()
+
+    def download(self, name, number, path, dest):
+        target = os.path.normpath(os.path.join(dest, path))
+        if not target.startswith(os.path.normpath(dest) + os.sep):
+            raise JenkinsError('artifact %s is outside of %s' % (path, dest))
+        url = job_url(ARTIFACT, name, number=number, path=quote(to_bytes(path)))
+        artifact = dict(path=path, dest=target)
+        source = dict(url='%s/%s' % (self.client.url, url))
+        if os.path.isfile(target) and self.read_source(target) == source:
+            response = self.client.open('HEAD', url)
+            if response.header('Content-Length') == str(os.path.getsize(target)):
+                artifact.update(size=os.path.getsize(target), status='skipped')
+                return artifact
+        if not os.path.isdir(os.path.dirname(target)):
+            try:
+                os.makedirs(os.path.dirname(target))
+            except OSError:
+                # Created meanwhile by another worker
+                if not os.path.isdir(os.path.dirname(target)):
+                    raise
+        part = '%s.%d.part' % (target, number)
+        self.remove_parts(target, part)
+        status = 'resumed' if os.path.isfile(part) else 'downloaded'
+        for attempt in range(self.retries + 1):
+            try:
+                if self.download_part(url, part):
+                    break
+            except TransportError:
+                if attempt == self.retries:
+                    raise
+        else:
+            raise JenkinsError('artifact %s is incomplete after %d attempts' % (path, self.retries + 1))
+        # Without its source file, a file left by an interruption here is downloaded again
+        if os.path.isfile(self.source_path(target)):
+            os.remove(self.source_path(target))
+        os.rename(part, target)
+        with open(self.source_path(target), 'w') as f:
+            json.dump(source, f)
+        artifact.update(size=os.path.getsize(target), status=status)
+        return artifact
+
+    @staticmethod
+    def source_path(target):
+        return os.path.join(os.path.dirname(target), '.%s.source' % os.path.basename(target))
+
+    def read_source(self, target):
+        """Return the source of the downloaded file, None if it is unknown."""
+        try:
+            with open(self.source_path(target)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    @staticmethod
+    def remove_parts(target, keep):
+        """Remove the part files of the artifact left by other builds."""
+        prefix = os.path.basename(target) + '.'
+        for entry in os.listdir(os.path.dirname(target)):
+            number = entry[len(prefix):-len('.part')]
+            if entry.startswith(prefix) and entry.endswith('.part') and number.isdigit() and \
+                    entry != os.path.basename(keep):
+                try:
+                    os.remove(os.path.join(os.path.dirname(target), entry))
+                except OSError:
+                    pass
+
+    def download_part(self, url, part):
+        """Append the rest of the artifact to the part file, return True if it is complete."""
+        offset = os.path.getsize(part) if os.path.isfile(part) else 0
+        headers = {'Range': 'bytes=%d-' % offset} if offset else None
+        response = self.client.request('GET', url, headers=headers, stream=True)
+        try:
+            if response.status == 416:
+                # Nothing left after the offset, the part file holds the whole artifact
+                return True
+            if response.status == 404:
+                raise NotFoundError(response)
+            if response.status >= 400:
+                raise HTTPError(response)
+            expected = int(response.header('Content-Length', -1))
+            mode = 'wb'
+            if response.status == 206:
+                start, total = content_range(response)
+                if start == offset:
+                    expected = total
+                    mode = 'ab'
+                elif offset:
+                    # The part file can't be completed with this range, download the whole artifact again
+                    response.close()
+                    os.remove(part)
+                    return self.download_part(url, part)
+            with open(part, mode) as f:
+                for chunk in response.iter_content(self.CHUNK_SIZE):
+                    f.write(chunk)
+        finally:
+            response.close()
+        return expected < 0 or os.path.getsize(part) == expected
+
+
+class DownstreamFinder:
+    """Find the builds triggered by a finished build.
+
+    Pipeline C(build) steps are listed in the downstreamBuilds of the run.
+    Builds of the downstream projects of the job are matched by their
+    upstream cause, in the queue or among the recent builds, for a few
+    seconds after the upstream build ended, since Jenkins queues them only
+    when the upstream build completes.
+    """
+
+    # Number of recent builds of a downstream project searched for the upstream cause
+    RECENT_BUILDS = 20
+    # Seconds to look for builds of the downstream projects
+    GRACE = 10
+
+    def __init__(self, client):
+        self.client = client
+
+    def start(self, build):
+        job = get_job_json(self.client, DOWNSTREAM_PROJECTS, build['name'])
+        build['full_name'] = job.get('fullName') or build['name']
+        build['downstream_projects'] = [project['fullName'] for project in job.get('downstreamProjects') or []]
+        build['discover_until'] = time.time() + self.GRACE
+        build['children'] = []
+        build['matched'] = set()
+
+    def find(self, build):
+        """Return the new children as (name, queue_id, number), and whether all of them are found."""
+        found = []
+        complete = True
+        run = get_job_json(self.client, DOWNSTREAM_BUILDS, build['name'], number=build['number'])
+        for action in run.get('actions') or []:
+            for child in (action or {}).get('downstreamBuilds') or []:
+                if child.get('buildNumber') is None:
+                    # Still in the queue, it gets a number later
+                    complete = False
+                elif (child['jobFullName'], child['buildNumber']) not in build['matched']:
+                    build['matched'].add((child['jobFullName'], child['buildNumber']))
+                    found.append((child['jobFullName'], None, child['buildNumber']))
+        projects = [project for project in build['downstream_projects'] if project not in build['matched']]
+        if projects:
+            queue = get_json(self.client, QUEUE_CAUSES, {})
+            for item in queue.get('items') or []:
+                project = (item.get('task') or {}).get('fullName')
+                if project in projects and self.caused_by(item, build):
+                    projects.remove(project)
+                    build['matched'].add(project)
+                    found.append((project, item['id'], None))
+        for project in projects:
+            job = get_job_json(self.client, UPSTREAM_CAUSES, project, limit=self.RECENT_BUILDS)
+            for child in job.get('builds') or []:
+                if self.caused_by(child, build):
+                    build['matched'].add(project)
+                    found.append((project, None, child['number']))
+                    break
+            else:
+                complete = False
+        return found, complete
+
+    def caused_by(self, item, build):
+        for action in item.get('actions') or []:
+            for cause in (action or {}).get('causes') or []:
+                if cause.get('upstreamProject') == build['full_name'] and \
+                   cause.get('upstreamBuild') == build['number']:
+                    return True
+        return False
+
+
+class BuildWaiter:
+    """Follow builds from their queue item to their end in one poll loop.
+
+    A tracked build is a dict with the C(name) of the job, its C(queue)
+    resolver and the C(number) once the build has started. Options are read
+    from the module params shared by jenkins_build and jenkins_build_wait.
+    """
+
+    def __init__(self, module, client):
+        self.module = module
+        self.client = client
+
+        self.jenkins_url = module.params.get('url')
+        self.wait_build_timeout = module.params.get('wait_build_timeout')
+        self.poll_interval = module.params.get('poll_interval')
+        self.max_poll_interval = module.params.get('max_poll_interval')
+        self.scheduler = PollScheduler(self.poll_interval, self.max_poll_interval)
+        self.console_output = module.params.get('console_output')
+        self.console_log_dir = module.params.get('console_log_dir')
+        self.console_output_head = module.params.get('console_output_head')
+        self.console_output_tail = module.params.get('console_output_tail')
+        self.wait_strategy = module.params.get('wait_strategy')
+        self.build_info_fields = list(module.params.get('build_info_fields'))
+        if module.params.get('fail') and 'result' not in self.build_info_fields:
+            self.build_info_fields.append('result')
+        self.metrics = Metrics(client)
+        self.downstream = DownstreamFinder(client) if module.params.get('wait_downstream') else None
+        # Builds found while waiting, added to the poll loop
+        self.new_builds = []
+        self.artifacts_dest = module.params.get('artifacts_dest')
+        self.fetcher = None
+        if module.params.get('artifacts'):
+            self.fetcher = ArtifactFetcher(client, module.params['artifacts'], module.params.get('artifacts_workers'))
+
+    def track(self, build, queue_id, number=None):
+        """Add the tracking state to the build dict and return it."""
+        build.update(queue=QueueItemResolver(self.client, build['name'], queue_id,
+                                             self.poll_interval, self.max_poll_interval),
+                     number=number, started=number is not None, console=None)
+        return build
+
+    def poll_queue(self, build):
+        """Poll the queue item once, return True once the build is started or cancelled."""
+        if build['started']:
+            return True
+        if not build['queue'].poll():
+            build['next_poll'] = time.time() + build['queue'].next_delay()
+            return False
+        if not build['queue'].cancelled:
+            build['number'] = build['queue'].number
+            build['started'] = True
+            build['started_at'] = time.time()
+        return True
+
+    def poll_build(self, build):
+        """Poll the queue item or the build once, return True when nothing is left to wait for."""
+        self.metrics.poll_iterations += 1
+        if build.get('discover_until') is not None:
+            return self.discover(build)
+        if not build['started']:
+            if not self.poll_queue(build) or build['queue'].cancelled:
+                return build['queue'].cancelled
+        if build['console'] is None and self.console_log_dir:
+            # Also for the builds tracked with their number, from a handle or found by dedupe
+            build['console'] = self.stream_console(build)
+        if build['console'] is not None:
+            # The log is complete once the build is finished, no need to poll the build itself
+            if build['console'].fetch():
+                build['next_poll'] = time.time() + build['console'].next_delay()
+                return False
+            return self.finished(build)
+        build_info = get_build_json(self.client, build['name'], build['number'], BUILD_POLL_FIELDS)
+        if not build_info['building']:
+            return self.finished(build)
+        build['next_poll'] = time.time() + self.scheduler.next_delay(build, build_info)
+        return False
+
+    def finished(self, build):
+        build['finished'] = time.time()
+        if self.downstream is None:
+            return True
+        self.downstream.start(build)
+        return self.discover(build)
+
+    def discover(self, build):
+        """Start following the downstream builds, return True once all of them are found."""
+        found, complete = self.downstream.find(build)
+        for name, queue_id, number in found:
+            child = self.track(dict(name=name), queue_id, number)
+            child['next_poll'] = time.time()
+            self.scheduler.reset(child)
+            build['children'].append(child)
+            self.new_builds.append(child)
+        if complete or time.time() >= build['discover_until']:
+            return True
+        build['next_poll'] = time.time() + self.poll_interval
+        return False
+
+    def wait(self, builds):
+        deadline = time.time() + self.wait_build_timeout
+        if self.wait_strategy == 'server':
+            builds = self.wait_on_server(builds, deadline)
+        self.poll(builds, deadline)
+
+    def wait_on_server(self, builds, deadline):
+        """Wait for the builds with scripts blocking in Jenkins, return the builds left to poll.
+
+        Those are all the builds if the user may not run scripts, otherwise the
+        builds still looking for downstream builds and the downstream builds.
+        """
+        pending = [build for build in builds if not build['queue'].cancelled]
+        while pending:
+            wait = min(deadline - time.time(), SERVER_WAIT_SLICE)
+            if wait <= 0:
+                self.timeout_exceeded(pending)
+            states = [dict(name=build['name'], queue_id=build['queue'].queue_id, number=build['number'],
+                           building=True, cancelled=False, lost=False, queue_time=None, duration=None)
+                      for build in pending]
+            script = SERVER_WAIT_SCRIPT % dict(builds=to_native(base64.b64encode(to_bytes(json.dumps(states)))),
+                                               wait=wait * 1000, recent=QueueItemResolver.RECENT_BUILDS,
+                                               interval=SERVER_WAIT_INTERVAL)
+            self.metrics.poll_iterations += 1
+            try:
+                output = run_script(self.client, script, timeout=wait + self.client.timeout)
+                for build, state in zip(pending, json.loads(output.strip().splitlines()[-1])):
+                    self.update_from_server(build, state)
+            except (JenkinsError, ValueError, IndexError) as e:
+                if isinstance(e, HTTPError) and e.status == 403:
+                    self.module.warn('Not allowed to run scripts in Jenkins, polling the builds instead')
+                    return builds
+                self.module.fail_json(msg='Unable to wait for the builds in Jenkins, %s for %s' % (
+                                      to_native(e), self.jenkins_url), exception=traceback.format_exc())
+            pending = [build for build in pending if build.get('finished') is None and not build['queue'].cancelled]
+        left = []
+        for build in builds:
+            if build['started'] and self.console_log_dir:
+                if build['console'] is None:
+                    build['console'] = self.stream_console(build)
+                while build['console'].fetch():
+                    time.sleep(build['console'].next_delay())
+            if build['started'] and not self.finished(build):
+                left.append(build)
+        left.extend(self.new_builds)
+        self.new_builds = []
+        return left
+
+    def update_from_server(self, build, state):
+        queue = build['queue']
+        if state['lost']:
+            raise JenkinsError('queue item %d of %s not found in the queue nor in the builds'
+                               % (queue.queue_id, build['name']))
+        if state['cancelled']:
+            queue.cancelled = True
+            return
+        if state['number'] is not None and not build['started']:
+            queue.number = build['number'] = state['number']
+            if state['queue_time'] is not None:
+                queue.latency = round(state['queue_time'] / 1000.0, 3)
+            build['started'] = True
+            build['started_at'] = time.time()
+        if not state['building']:
+            build['finished'] = time.time()
+            build['started_at'] = build['finished'] - state['duration'] / 1000.0
+
+    def poll(self, builds, deadline):
+        # All builds are polled from one loop, so waiting takes as long as the slowest build
+        pending = list(builds)
+        for build in pending:
+            build['next_poll'] = time.time()
+            self.scheduler.reset(build)
+        while True:
+            try:
+                pending = [build for build in pending
+                           if build['next_poll'] > time.time() or not self.poll_build(build)]
+                # Downstream builds share the deadline of the builds that triggered them
+                pending.extend(self.new_builds)
+                self.new_builds = []
+            except JenkinsError as e:
+                self.module.fail_json(msg='Unable to follow the builds, %s for %s' % (to_native(e), self.jenkins_url),
+                                      exception=traceback.format_exc())
+            if not pending:
+                return
+            now = time.time()
+            if now >= deadline:
+                break
+            time.sleep(max(0, min(min(build['next_poll'] for build in pending), deadline) - now))
+        self.timeout_exceeded(pending)
+
+    def timeout_exceeded(self, pending):
+        self.module.fail_json(msg='Job build complete timeout exceed, %s for %s' % (
+                              ', '.join(build['name'] for build in pending), self.jenkins_url),
+                              exception=traceback.format_exc())
+
+    def stream_console(self, build):
+        path = os.path.join(self.console_log_dir, '%s_%d.log' % (build['name'].replace('/', '_'), build['number']))
+        try:
+            if not os.path.isdir(self.console_log_dir):
+                os.makedirs(self.console_log_dir)
+            return ConsoleStreamer(self.client, build['name'], build['number'], path,
+                                   self.console_output_head, self.console_output_tail,
+                                   self.poll_interval, self.max_poll_interval)
+        except (IOError, OSError) as e:
+            self.module.fail_json(msg='Unable to write console log %s, %s' % (path, to_native(e)),
+                                  exception=traceback.format_exc())
+
+    def get_build_info(self, build):
+        build_info = get_build_json(self.client, build['name'], build['number'], self.build_info_fields)
+        if build['console'] is not None:
+            build['console'].close()
+            build_info['console_log'] = build['console'].path
+            build_info['console_output'] = build['console'].output()
+        elif self.console_output:
+            response = self.client.open('GET', job_url(CONSOLE_TEXT, build['name'], number=build['number']))
+            build_info['console_output'] = to_native(response.content, errors='surrogate_or_replace')
+        return build_info
+
+    def handle(self, build):
+        """Return what jenkins_build_wait needs to find the build again."""
+        return dict(name=build['name'], queue_id=build['queue'].queue_id, number=build['number'])
+
+    def fetch_artifacts(self, build, dest):
+        try:
+            return self.fetcher.fetch(build['name'], build['number'], dest)
+        except Exception as e:
+            self.module.fail_json(msg='Unable to download artifacts of %s #%d, %s' % (build['name'], build['number'],
+                                                                                    to_native(e)),
+                                  exception=traceback.format_exc())
+
+    def collect(self, builds, fetch_artifacts=True):
+        """Return the handle, queue info and build info of every build.
+
+        Artifacts of finished builds are downloaded into I(artifacts_dest), in a
+        subdirectory named after the job if there are several builds.
+        """
+        collected = []
+        for build in builds:
+            entry = dict(name=build['name'], handle=self.handle(build), queue_info=build['queue'].info(),
+                         build_info=self.get_build_info(build) if build['started'] else {})
+            if self.downstream is not None:
+                entry['downstream'] = self.downstream_tree(build)
+            if self.fetcher is not None and fetch_artifacts and build['started']:
+                dest = self.artifacts_dest
+                if len(builds) > 1:
+                    dest = os.path.join(dest, build['name'])
+                entry['artifacts'] = self.fetch_artifacts(build, dest)
+            collected.append(entry)
+        return collected
+
+    def downstream_tree(self, build):
+        """Return the result and duration of the builds triggered by the build, recursively."""
+        nodes = []
+        for child in build.get('children', []):
+            node = dict(name=child['name'], number=child['number'], url=None, result=None, duration=None)
+            if child['started']:
+                info = get_build_json(self.client, child['name'], child['number'], ['url', 'result', 'duration'])
+                node.update(url=info.get('url'), result=info.get('result'), duration=info.get('duration'))
+            node['downstream'] = self.downstream_tree(child)
+            nodes.append(node)
+        return nodes
+
+    def is_success(self, entry):
+        """Tell if the collected build and all of its downstream builds are successful."""
+        return entry['build_info'].get('result') == 'SUCCESS' and \
+            all(self.is_tree_success(node) for node in entry.get('downstream', []))
+
+    def is_tree_success(self, node):
+        return node['result'] == 'SUCCESS' and all(self.is_tree_success(child) for child in node['downstream'])
+
+    def check_cancelled(self, builds, result):
+        cancelled = [build['name'] for build in builds if build['queue'].cancelled]
+        if cancelled:
+            result['msg'] = 'Queue item cancelled for %s' % ', '.join(cancelled)
+            self.module.fail_json(**result)
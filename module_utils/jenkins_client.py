@@ -0,0 +1,790 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright: (c) Ansible Project
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+#
+# HTTP client shared by the jenkins modules, so they authenticate, validate
+# certificates and reuse connections to the controller the same way.
+#
+# It only needs the standard library: the modules start in a fresh Python
+# process for every task, and importing python-jenkins with requests takes
+# longer than most of the requests the modules send.
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import base64
+import errno
+import hashlib
+import json
+import os
+import re
+import select
+import socket
+import ssl
+import tempfile
+import threading
+import time
+import traceback
+from email.utils import mktime_tz, parsedate_tz
+from ansible.module_utils._text import to_bytes, to_native
+from ansible.module_utils.six.moves import http_client
+from ansible.module_utils.six.moves.urllib.parse import quote, unquote, urlencode, urlsplit
+from ansible.module_utils.six.moves.urllib.request import getproxies, proxy_bypass
+
+# Idle connections kept alive per host, more are opened but not kept when the
+# modules send requests from several threads
+POOL_SIZE = 10
+RETRIES = 3
+MAX_REDIRECTS = 5
+CRUMB_ISSUER = 'crumbIssuer/api/json'
+JOB_PARAMS = '%(folder_url)sjob/%(short_name)s/api/json?tree=property[parameterDefinitions[name]]'
+SCRIPT_TEXT = 'scriptText'
+# Printed after the script, an output without it didn't come from the script console
+SCRIPT_END = ')]}.'
+# Runs scripts one after the other in the script console, each compiled on its
+# own with the imports of the console, and prints as JSON their value, output,
+# error and duration. Outputs and stack traces are cut after max_output
+# characters in Jenkins already.
+SCRIPTS_BATCH = '''
+import groovy.json.JsonOutput
+import groovy.json.JsonSlurper
+import org.codehaus.groovy.control.CompilerConfiguration
+import org.codehaus.groovy.control.customizers.ImportCustomizer
+
+class CappedWriter extends Writer {
+    StringBuilder text = new StringBuilder()
+    int max
+    boolean truncated = false
+
+    void write(char[] chars, int offset, int length) {
+        if (max > 0 && text.length() + length > max) {
+            text.append(chars, offset, Math.max(0, max - text.length()))
+            truncated = true
+        } else {
+            text.append(chars, offset, length)
+        }
+    }
+
+    void flush() {}
+
+    void close() {}
+}
+
+def plain
+plain = { value ->
+    if (value == null || value instanceof Number || value instanceof Boolean || value instanceof String) {
+        return value
+    }
+    if (value instanceof Map) {
+        return value.collectEntries { key, item -> [(String.valueOf(key)): plain(item)] }
+    }
+    if (value instanceof Collection || value instanceof Object[]) {
+        return value.collect { plain(it) }
+    }
+    return String.valueOf(value)
+}
+
+def scripts = new JsonSlurper().parseText(new String('%(scripts)s'.decodeBase64(), 'UTF-8'))
+def config = new CompilerConfiguration()
+config.addCompilationCustomizers(new ImportCustomizer().addStarImports('jenkins', 'jenkins.model', 'hudson', 'hudson.model'))
+def loader = Jenkins.instance.pluginManager.uberClassLoader
+def results = scripts.collect { source ->
+    def output = new CappedWriter(max: %(max_output)d)
+    def started = System.currentTimeMillis()
+    def result = [result: null, exception: null, message: null, error: null]
+    try {
+        def binding = new Binding(out: new PrintWriter(output, true))
+        result.result = plain(new GroovyShell(loader, binding, config).evaluate(source))
+    } catch (Throwable e) {
+        def trace = new CappedWriter(max: %(max_output)d)
+        e.printStackTrace(new PrintWriter(trace, true))
+        result.putAll(exception: e.getClass().name, message: e.message, error: trace.text.toString())
+    }
+    result.putAll(output: output.text.toString(), truncated: output.truncated,
+                  duration: System.currentTimeMillis() - started)
+    result
+}
+println(JsonOutput.toJson(results))
+'''
+# Crumbs are bound to the web session of the controller, which expires after
+# 30 minutes of inactivity by default
+CRUMB_EXPIRATION = 300
+# Longest Retry-After honoured, sec
+MAX_RETRY_AFTER = 60
+
+
+class JenkinsError(Exception):
+    """The controller couldn't be reached or answered with an error."""
+
+
+class TransportError(JenkinsError):
+    """The connection to the controller failed or timed out."""
+
+
+class HTTPError(JenkinsError):
+
+    def __init__(self, response):
+        self.status = response.status
+        super(HTTPError, self).__init__('HTTP Error %d: %s for %s' % (response.status, response.reason, response.url))
+
+
+class NotFoundError(HTTPError):
+    pass
+
+
+def job_url(url_format, name, **variables):
+    """Return the path of a job url, the job name may contain folders."""
+    parts = [quote(to_bytes(part)) for part in name.split('/')]
+    variables.update(folder_url=''.join('job/%s/' % part for part in parts[:-1]), short_name=parts[-1])
+    return url_format % variables
+
+
+class Response:
+    """Response of the client, with the whole body in C(content) unless it is streamed.
+
+    The connection goes back to the pool once the body is read, a streamed
+    response must be read with iter_content() or closed.
+    """
+
+    def __init__(self, client, key, conn, resp, url, stream, slot=None):
+        self.client = client
+        self.slot = slot
+        self.key = key
+        self.conn = conn
+        self.resp = resp
+        self.url = url
+        self.status = resp.status
+        self.reason = resp.reason
+        self.headers = dict((name.lower(), value) for name, value in resp.getheaders())
+        self.content = None
+        if not stream:
+            self.content = resp.read()
+            self.release()
+
+    def header(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    def json(self):
+        return json.loads(to_native(self.content))
+
+    def iter_content(self, chunk_size):
+        while True:
+            try:
+                chunk = self.resp.read(chunk_size)
+            except (socket.error, http_client.HTTPException) as e:
+                self.close()
+                raise TransportError('Reading %s failed, %s' % (self.url, to_native(e)))
+            if not chunk:
+                break
+            yield chunk
+        self.release()
+
+    def release(self):
+        if self.conn is not None:
+            self.client.release(self.key, self.conn)
+            self.conn = None
+        self.free_slot()
+
+    def close(self):
+        if self.conn is not None:
+            if self.resp.isclosed():
+                self.release()
+            else:
+                # The rest of the body is not wanted, the connection can't be reused
+                self.conn.close()
+                self.conn = None
+        self.free_slot()
+
+    def free_slot(self):
+        if self.slot is not None:
+            self.client.release_slot(self.slot)
+            self.slot = None
+
+
+def load_json_cache(path, expiration):
+    """Return the entries of a json cache file younger than expiration seconds."""
+    try:
+        with open(path) as f:
+            entries = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    now = time.time()
+    return dict((key, entry) for key, entry in entries.items() if now - entry['time'] < expiration)
+
+
+def write_json_cache(path, data):
+    """Replace a json cache file at once, the tasks reading it never see it half written.
+
+    The file is readable by the user only, the caches hold session cookies
+    and the output of scripts. Raise IOError or OSError if it can't be written.
+    """
+    cache_dir = os.path.dirname(path)
+    try:
+        os.makedirs(cache_dir, int('0700', 8))
+    except OSError as e:
+        # Other tasks of the play create it at the same time
+        if e.errno != errno.EEXIST:
+            raise
+    cache_fd, cache_file = tempfile.mkstemp(dir=cache_dir)
+    with os.fdopen(cache_fd, 'w') as f:
+        json.dump(data, f)
+    os.rename(cache_file, path)
+
+
+class CrumbCache:
+    """Crumbs of the controllers and the session cookies they belong to, kept
+    on disk for CRUMB_EXPIRATION seconds.
+
+    Entries are keyed by url and user, an empty crumb means the controller
+    doesn't ask for crumbs.
+    """
+
+    def __init__(self, module, url, user):
+        self.module = module
+        self.key = '%s|%s' % (url, user or '')
+        self.path = os.path.expanduser('~/.ansible/tmp/jenkins-crumb-cache.json')
+
+    def load(self):
+        return load_json_cache(self.path, CRUMB_EXPIRATION)
+
+    def get(self):
+        """Return the cached entry with the crumb and cookies, None if there is none."""
+        return self.load().get(self.key)
+
+    def save(self, crumb, cookies):
+        self.write(dict(time=time.time(), crumb=crumb, cookies=cookies))
+
+    def invalidate(self):
+        self.write(None)
+
+    def write(self, entry):
+        # Keep the entries written meanwhile by other tasks
+        entries = self.load()
+        if entry is None:
+            if entries.pop(self.key, None) is None:
+                return
+        else:
+            entries[self.key] = entry
+        try:
+            write_json_cache(self.path, entries)
+        except (IOError, OSError) as e:
+            self.module.warn('Unable to save crumb cache %s, %s' % (self.path, to_native(e)))
+
+
+class JobParamsCache:
+    """Parameter names of the jobs, kept on disk for I(params_cache_expiration) seconds.
+
+    Knowing whether a job is parameterized before triggering it lets the
+    module pick the right build endpoint and check the params locally.
+    """
+
+    def __init__(self, module, client, expiration):
+        self.module = module
+        self.client = client
+        self.url = module.params.get('url')
+        self.expiration = expiration
+        self.path = os.path.expanduser('~/.ansible/tmp/jenkins-job-params-cache.json')
+        self.fetched = set()
+        self.entries = self.load()
+
+    def load(self):
+        if not self.expiration:
+            return {}
+        return load_json_cache(self.path, self.expiration)
+
+    def get(self, name, refresh=False):
+        """Return the parameter names of the job, None if the job doesn't exist."""
+        key = '%s|%s' % (self.url, name)
+        if refresh or key not in self.entries:
+            try:
+                job = self.client.get_json(job_url(JOB_PARAMS, name))
+            except NotFoundError:
+                return None
+            self.entries[key] = dict(time=time.time(),
+                                     params=[definition['name']
+                                             for prop in job.get('property') or []
+                                             for definition in prop.get('parameterDefinitions') or []])
+            self.fetched.add(key)
+        return self.entries[key]['params']
+
+    def is_fresh(self, name):
+        return '%s|%s' % (self.url, name) in self.fetched
+
+    def save(self):
+        if not (self.expiration and self.fetched):
+            return
+        # Keep the entries written meanwhile by other tasks
+        entries = self.load()
+        entries.update(self.entries)
+        try:
+            write_json_cache(self.path, entries)
+        except (IOError, OSError) as e:
+            self.module.warn('Unable to save job parameters cache %s, %s' % (self.path, to_native(e)))
+
+
+class RateLimiter:
+    """Token bucket and in-flight request slots shared by all the tasks
+    sending requests to a controller.
+
+    The state is kept in a file per controller url locked with flock, so the
+    forks of a play and the threads of a task take tokens from the same
+    bucket. The bucket holds up to a second of requests. Slots of the tasks
+    that were killed are freed by the next task looking at them. A
+    Retry-After of the controller pauses every task.
+    """
+
+    def __init__(self, module, url, rate=0, max_in_flight=0):
+        self.module = module
+        self.rate = rate
+        self.max_in_flight = max_in_flight
+        self.path = os.path.expanduser('~/.ansible/tmp/jenkins-rate-%s.json'
+                                       % hashlib.sha1(to_bytes(url)).hexdigest()[:16])
+        self.slots = 0
+
+    def update(self, change):
+        """Apply change to the state under the lock, it returns the seconds to wait or None."""
+        import fcntl
+        cache_dir = os.path.dirname(self.path)
+        if not os.path.isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir, int('0700', 8))
+            except OSError as e:
+                # Another fork may have created it meanwhile
+                if e.errno != errno.EEXIST:
+                    raise
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                state = json.loads(f.read())
+            except ValueError:
+                state = {}
+            state.setdefault('tokens', max(self.rate, 1))
+            state.setdefault('updated', time.time())
+            state.setdefault('paused_until', 0)
+            state.setdefault('in_flight', {})
+            wait = change(state, time.time())
+            f.seek(0)
+            f.truncate()
+            json.dump(state, f)
+            return wait
+
+    def acquire(self):
+        """Wait for a token and a free slot, return the slot."""
+        self.slots += 1
+        slot = '%d-%d-%d' % (os.getpid(), threading.current_thread().ident, self.slots)
+
+        def take(state, now):
+            if self.rate:
+                state['tokens'] = min(max(self.rate, 1), state['tokens'] + (now - state['updated']) * self.rate)
+            state['updated'] = now
+            if now < state['paused_until']:
+                return state['paused_until'] - now
+            if self.max_in_flight and len(state['in_flight']) >= self.max_in_flight:
+                for other, pid in list(state['in_flight'].items()):
+                    if not self.alive(pid):
+                        del state['in_flight'][other]
+                if len(state['in_flight']) >= self.max_in_flight:
+                    return 0.05
+            if self.rate:
+                if state['tokens'] < 1:
+                    return (1 - state['tokens']) / self.rate
+                state['tokens'] -= 1
+            if self.max_in_flight:
+                state['in_flight'][slot] = os.getpid()
+            return None
+
+        while True:
+            wait = self.update(take)
+            if wait is None:
+                return slot
+            time.sleep(wait)
+
+    def release(self, slot):
+        if self.max_in_flight:
+            self.update(lambda state, now: state['in_flight'].pop(slot, None) and None)
+
+    def pause(self, seconds):
+        """Hold the requests of every task for the seconds of a Retry-After."""
+        def hold(state, now):
+            state['paused_until'] = max(state['paused_until'], now + seconds)
+        self.update(hold)
+
+    @staticmethod
+    def alive(pid):
+        try:
+            os.kill(pid, 0)
+        except OSError as e:
+            return e.errno != errno.ESRCH
+        return True
+
+
+def dropped(conn):
+    """Tell if the controller has closed an idle connection, it is readable then."""
+    if conn.sock is None:
+        return True
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (ValueError, select.error, socket.error):
+        return True
+
+
+def rejected_crumb(response):
+    """Tell whether Jenkins refused the crumb of the request rather than the user."""
+    # The body of a streamed response is left to the caller
+    return response.content is None or b'No valid crumb' in response.content
+
+
+def is_stale(error):
+    """Tell if the error is that of an idle connection closed by the controller before it answered."""
+    if isinstance(error, socket.timeout):
+        return False
+    if isinstance(error, http_client.BadStatusLine):
+        # RemoteDisconnected on Python 3, an empty status line on Python 2
+        remote_disconnected = getattr(http_client, 'RemoteDisconnected', None)
+        return (remote_disconnected is not None and isinstance(error, remote_disconnected) or
+                error.line in ('', "''"))
+    return getattr(error, 'errno', None) in (errno.EPIPE, errno.ECONNRESET)
+
+
+def retry_after(value):
+    """Return the seconds of a Retry-After header, in seconds or an HTTP date."""
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        date = parsedate_tz(value or '')
+        if date is None:
+            return None
+        seconds = mktime_tz(date) - time.time()
+    return min(max(seconds, 0), MAX_RETRY_AFTER)
+
+
+class JenkinsClient:
+    """Keep-alive connection pool to a Jenkins controller.
+
+    Idle connections are kept by host and reused by the next request, which
+    saves a TCP and TLS handshake per request. Requests are counted by
+    endpoint.
+
+    POST requests get the crumb of the controller, from the crumb cache when
+    another task has fetched it recently. A POST rejected with 403 because
+    the cached crumb has expired is sent once more with a new crumb.
+
+    With the rate_limit or max_in_flight options of the module requests go
+    through the RateLimiter of the controller. Requests refused with 429, and
+    GET requests refused with 503, are sent again after their Retry-After.
+    """
+
+    def __init__(self, module, url, user=None, password=None, timeout=10, validate_certs=True,
+                 pool_size=POOL_SIZE):
+        self.module = module
+        self.url = url.rstrip('/')
+        self.netloc = urlsplit(self.url).netloc
+        self.user = user
+        self.password = password
+        self.timeout = timeout
+        self.validate_certs = validate_certs
+        self.pool_size = pool_size
+        self.use_proxy = module.params.get('use_proxy') is not False
+        self.client_cert = module.params.get('client_cert')
+        self.client_key = module.params.get('client_key')
+        self._crumb = None
+        # The crumb loaded from the cache, it may have expired meanwhile
+        self.cached_crumb = None
+        self.crumb_cache = CrumbCache(module, self.url, user)
+        self.limiter = None
+        if module.params.get('rate_limit') or module.params.get('max_in_flight'):
+            self.limiter = RateLimiter(module, self.url, module.params.get('rate_limit') or 0,
+                                       module.params.get('max_in_flight') or 0)
+
+        # Sent to the controller only, not to the hosts it may redirect to
+        self.headers = {}
+        if user and password:
+            self.headers['Authorization'] = 'Basic %s' % to_native(base64.b64encode(
+                to_bytes('%s:%s' % (user, password), errors='surrogate_or_strict')))
+        self.cookies = {}
+        self.agent = module.params.get('http_agent') or 'ansible-jenkins'
+
+        self.lock = threading.Lock()
+        self.crumb_lock = threading.Lock()
+        self.pool = {}
+        self.requests = {}
+        self.bytes_received = 0
+
+    def connect(self, scheme, netloc):
+        proxy, proxy_headers = self.proxy(scheme, netloc)
+        if scheme == 'https':
+            context = ssl.create_default_context()
+            if not self.validate_certs:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            if self.client_cert:
+                context.load_cert_chain(self.client_cert, self.client_key)
+            conn = http_client.HTTPSConnection(proxy or netloc, timeout=self.timeout, context=context)
+            if proxy:
+                conn.set_tunnel(netloc, headers=proxy_headers)
+        else:
+            conn = http_client.HTTPConnection(proxy or netloc, timeout=self.timeout)
+        # Requests sent to an http proxy carry the whole url, and its credentials
+        conn.absolute_urls = bool(proxy) and scheme == 'http'
+        conn.proxy_headers = proxy_headers if conn.absolute_urls else {}
+        return conn
+
+    def proxy(self, scheme, netloc):
+        """Return the host and port of the proxy for the scheme, with the headers of its credentials."""
+        if not self.use_proxy:
+            return None, {}
+        proxy = getproxies().get(scheme)
+        if not proxy or proxy_bypass(netloc.rsplit(':', 1)[0]):
+            return None, {}
+        parts = urlsplit(proxy if '//' in proxy else '//' + proxy)
+        host = '[%s]' % parts.hostname if ':' in parts.hostname else parts.hostname
+        if parts.port:
+            host += ':%d' % parts.port
+        headers = {}
+        if parts.username is not None:
+            credentials = '%s:%s' % (unquote(parts.username), unquote(parts.password or ''))
+            headers['Proxy-Authorization'] = 'Basic %s' % to_native(base64.b64encode(
+                to_bytes(credentials, errors='surrogate_or_strict')))
+        return host, headers
+
+    def acquire(self, key):
+        """Return an idle connection to the host and whether it was used before."""
+        while True:
+            with self.lock:
+                idle = self.pool.get(key)
+                if not idle:
+                    break
+                conn = idle.pop()
+            if not dropped(conn):
+                return conn, True
+            conn.close()
+        return self.connect(*key), False
+
+    def take_slot(self):
+        """Wait for the rate limit of the controller and return the slot of the request, if it is limited."""
+        return self.limit('acquire') or None
+
+    def release_slot(self, slot):
+        if slot is not None:
+            self.limit('release', slot)
+
+    def pause(self, seconds):
+        if self.limiter is None or self.limit('pause', seconds) is False:
+            time.sleep(seconds)
+
+    def limit(self, action, *args):
+        if self.limiter is None:
+            return None
+        try:
+            return getattr(self.limiter, action)(*args)
+        except (IOError, OSError) as e:
+            # Requests are sent without limit rather than failing the task
+            self.module.warn('Unable to use rate limit state %s, %s' % (self.limiter.path, to_native(e)))
+            self.limiter = None
+            return False
+
+    def release(self, key, conn):
+        with self.lock:
+            idle = self.pool.setdefault(key, [])
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def send(self, method, url, body=None, headers=None, stream=False, timeout=None):
+        """Send one request and return the response, retrying on connection errors."""
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = dict(headers or {})
+        headers.setdefault('User-Agent', self.agent)
+        if parts.netloc == self.netloc:
+            headers.update(self.headers)
+            if self.cookies:
+                headers['Cookie'] = '; '.join('%s=%s' % cookie for cookie in self.cookies.items())
+        attempt = 0
+        refused = 0
+        while True:
+            slot = self.take_slot()
+            conn, reused = self.acquire(key)
+            conn.timeout = timeout or self.timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(conn.timeout)
+            sent = False
+            try:
+                conn.request(method, url if conn.absolute_urls else path, body, dict(headers, **conn.proxy_headers))
+                sent = True
+                response = Response(self, key, conn, conn.getresponse(), url, stream, slot)
+            except (socket.error, http_client.HTTPException) as e:
+                conn.close()
+                self.release_slot(slot)
+                idempotent = method in ('GET', 'HEAD')
+                # The controller may have closed an idle connection meanwhile,
+                # a request it can't have run is sent again on a new one
+                if reused and is_stale(e) and (idempotent or not sent):
+                    continue
+                # Other failures are retried for the requests without side
+                # effects, but not after a timeout, the controller may still
+                # be working on them
+                attempt += 1
+                if (attempt > RETRIES or not idempotent or
+                        isinstance(e, (ssl.SSLError, socket.timeout))):
+                    raise TransportError('%s %s failed, %s' % (method, url, to_native(e)))
+                time.sleep(0.1 * 2 ** attempt)
+                continue
+            delay = retry_after(response.header('Retry-After'))
+            if (delay is None or refused >= RETRIES or
+                    not (response.status == 429 or response.status == 503 and method in ('GET', 'HEAD'))):
+                break
+            # The controller is overloaded, hold the requests of every task for the time it asks for
+            refused += 1
+            self.count(url, response)
+            response.close()
+            self.pause(delay)
+        if parts.netloc == self.netloc:
+            for name, value in response.resp.getheaders():
+                if name.lower() == 'set-cookie':
+                    cookie = value.split(';', 1)[0]
+                    if '=' in cookie:
+                        name, value = cookie.split('=', 1)
+                        self.cookies[name.strip()] = value.strip()
+        self.count(url, response)
+        return response
+
+    def request(self, method, path, data=None, headers=None, stream=False, timeout=None):
+        """Send a request to a path or url of the controller and return the response whatever its status.
+
+        A dict of data is sent form encoded. Redirects are followed. The
+        timeout replaces the one of the client for this request.
+        """
+        url = path if '://' in path else '%s/%s' % (self.url, path.lstrip('/'))
+        headers = dict(headers or {})
+        if isinstance(data, dict):
+            data = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        body = to_bytes(data) if data is not None else None
+        crumb = {}
+        if method == 'POST':
+            crumb = self.crumb()
+            headers.update(crumb)
+        response = self.send(method, url, body, headers, stream, timeout)
+        if response.status == 403 and crumb and crumb is self.cached_crumb and rejected_crumb(response):
+            # The crumb or its session expired since it was cached, a fresh one
+            # that gets a 403 as well is refused for good and is not retried
+            response.close()
+            self.crumb_cache.invalidate()
+            for field in crumb:
+                headers.pop(field)
+            headers.update(self.crumb(refresh=True))
+            response = self.send(method, url, body, headers, stream, timeout)
+        for redirect in range(MAX_REDIRECTS):
+            if response.status not in (301, 302, 303, 307, 308) or not response.header('Location'):
+                break
+            response.close()
+            if response.status in (301, 302, 303):
+                method, body = 'GET', None
+                headers.pop('Content-Type', None)
+            url = self.join(url, response.header('Location'))
+            response = self.send(method, url, body, headers, stream, timeout)
+        return response
+
+    def join(self, url, location):
+        if '://' in location:
+            return location
+        parts = urlsplit(url)
+        return '%s://%s%s' % (parts.scheme, parts.netloc, location)
+
+    def open(self, method, path, data=None, headers=None, stream=False, timeout=None):
+        """Send a request and return the response, raise HTTPError if it failed."""
+        response = self.request(method, path, data, headers, stream, timeout)
+        if response.status >= 400:
+            response.close()
+            if response.status == 404:
+                raise NotFoundError(response)
+            raise HTTPError(response)
+        return response
+
+    def get_json(self, path):
+        return self.open('GET', path).json()
+
+    def crumb(self, refresh=False):
+        """Return the crumb header to POST with, empty if the controller doesn't use crumbs."""
+        # Threads posting at the same time wait for the crumb fetched by the first one
+        with self.crumb_lock:
+            if self._crumb is None and not refresh:
+                entry = self.crumb_cache.get()
+                if entry is not None:
+                    self.cookies.update(entry['cookies'])
+                    self._crumb = self.cached_crumb = entry['crumb']
+            if self._crumb is None or refresh:
+                try:
+                    data = self.get_json(CRUMB_ISSUER)
+                    self._crumb = {data['crumbRequestField']: data['crumb']}
+                except NotFoundError:
+                    self._crumb = {}
+                self.crumb_cache.save(self._crumb, self.cookies)
+            return self._crumb
+
+    def endpoint(self, url):
+        """Return the path of the url without the names of the jobs and the numbers."""
+        path = url[len(self.url) + 1:] if url.startswith(self.url + '/') else url
+        path = re.sub(r'(job/[^/]+/)+', 'job/*/', path.split('?')[0])
+        path = re.sub(r'/\d+/', '/*/', path)
+        return re.sub(r'/artifact/.*', '/artifact', path)
+
+    def count(self, url, response):
+        if response.content is None:
+            size = int(response.header('Content-Length') or 0)
+        else:
+            size = len(response.content)
+        endpoint = self.endpoint(url)
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            self.bytes_received += size
+
+
+def run_script(client, script, path=SCRIPT_TEXT, timeout=None):
+    """Run a groovy script in the script console and return its output."""
+    response = client.open('POST', path, data={'script': '%s\nprint("%s")' % (script, SCRIPT_END)},
+                           timeout=timeout)
+    output = to_native(response.content, errors='surrogate_or_replace')
+    if not output.endswith(SCRIPT_END):
+        raise JenkinsError('Unexpected script console output: %s' % output)
+    return output[:output.rfind('\n')]
+
+
+def run_scripts(client, scripts, max_output=0, path=SCRIPT_TEXT, timeout=None):
+    """Run groovy scripts in one request to the script console.
+
+    Return a list with the value of the last statement in C(result), the
+    C(output) and whether it was C(truncated) to max_output characters, the
+    C(exception) class, C(message) and C(error) stack trace or None, and the
+    C(duration) in milliseconds of every script. A failed script doesn't
+    stop the next ones.
+    """
+    batch = SCRIPTS_BATCH % dict(scripts=to_native(base64.b64encode(to_bytes(json.dumps(scripts)))),
+                                 max_output=max_output)
+    output = run_script(client, batch, path, timeout)
+    try:
+        results = json.loads(output.strip().split('\n')[-1])
+    except ValueError:
+        raise JenkinsError('Unexpected script console output: %s' % output)
+    if not isinstance(results, list) or len(results) != len(scripts):
+        raise JenkinsError('Unexpected script console output: %s' % output)
+    return results
+
+
+def get_jenkins_client(module, pool_size=POOL_SIZE):
+    """Return the client of the module connecting with its url, user, password or token."""
+    params = module.params
+    try:
+        return JenkinsClient(module, params.get('url'), params.get('user'),
+                             params.get('password') or params.get('token'),
+                             params.get('timeout'), params.get('validate_certs', True), pool_size)
+    except Exception as e:
+        module.fail_json(msg='Unable to connect to Jenkins server, %s' % to_native(e),
+                         exception=traceback.format_exc())
@@ -0,0 +1,509 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright: (c) Ansible Project
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Local stand-in for a Jenkins controller used by the benchmarks.
+
+It serves the endpoints the modules call: the crumb issuer, job, queue and
+build api, console logs, artifacts, the script console, the plugin manager
+and an update center, and the agents with their script consoles. Jobs named
+``missing...`` don't exist. Builds leave the queue after ``queue_delay`` seconds
+and run for ``build_duration`` seconds while their console log grows to
+``log_lines`` lines. Every request is delayed by ``latency`` seconds and
+counted with the bytes of its response.
+
+The script console does not run Groovy. It answers the scripts of
+``wait_strategy: server`` with the states of the builds, a batch of
+``scripts`` with a line of output per script, or an error for the scripts
+that ``throw``, and any other script with a line of output. Background
+scripts run for ``build_duration`` seconds and print a line per tenth of it.
+Registered scripts are kept until the fake Jenkins stops.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import base64
+import json
+import re
+import threading
+import time
+
+from ansible.module_utils.six.moves import BaseHTTPServer, socketserver
+from ansible.module_utils.six.moves.urllib.parse import parse_qs, unquote, urlsplit
+
+CRUMB = 'benchmark-crumb'
+CRUMB_FIELD = 'Jenkins-Crumb'
+SCRIPT_END = ')]}.'
+SCRIPTS_BATCH = re.compile(r"def scripts = new JsonSlurper\(\)\.parseText\(new String\('([A-Za-z0-9+/=]*)'")
+SERVER_WAIT = re.compile(r"new String\('([A-Za-z0-9+/=]*)'\.decodeBase64\(\).*?currentTimeMillis\(\) \+ (\d+)",
+                         re.DOTALL)
+BACKGROUND_START = re.compile(r"def source = new String\('([A-Za-z0-9+/=]*)'")
+BACKGROUND_STATUS = re.compile(r"def job = jobs\?\.get\('([^']*)'\).*?text\.length\(\) > (\d+)", re.DOTALL)
+REGISTERED_INSTALL = re.compile(r"def source = new String\('([A-Za-z0-9+/=]*)'.*?registry\.put\('([0-9a-f]+)'",
+                                re.DOTALL)
+REGISTERED_RUN = re.compile(r"def compiled = registry\?\.get\('([0-9a-f]+)'\).*?println\('([^']*)'\).*?"
+                            r"new String\('([A-Za-z0-9+/=]*)'", re.DOTALL)
+ARTIFACTS = ['out/report.txt', 'out/package.bin']
+ARTIFACT_SIZE = 1024 * 1024
+
+
+def parse_tree(tree):
+    """Parse a tree query into nested dicts of the selected fields."""
+    def parse(pos):
+        fields = {}
+        name = ''
+        while pos < len(tree):
+            char = tree[pos]
+            if char == '[':
+                fields[name], pos = parse(pos + 1)
+                name = ''
+            elif char == ']':
+                break
+            elif char == '{':
+                pos = tree.index('}', pos)
+            elif char == ',':
+                if name:
+                    fields[name] = None
+                name = ''
+            else:
+                name += char
+            pos += 1
+        if name:
+            fields[name] = None
+        return fields, pos
+    return parse(0)[0]
+
+
+def apply_tree(data, tree):
+    """Keep the fields of the data selected by a parsed tree query."""
+    if tree is None:
+        return data
+    if isinstance(data, list):
+        return [apply_tree(item, tree) for item in data]
+    if not isinstance(data, dict):
+        return data
+    result = {}
+    for name, sub in tree.items():
+        if name in data:
+            value = data[name]
+            result[name] = apply_tree(value, sub if sub is not None or not isinstance(value, (dict, list)) else {})
+    if '_class' in data:
+        result['_class'] = data['_class']
+    return result
+
+
+class FakeJenkins(object):
+    """Jenkins stand-in running in a background thread."""
+
+    def __init__(self, queue_delay=0.5, build_duration=2.0, log_lines=10000, plugins=300,
+                 update_center_plugins=2000, agents=50, latency=0.0):
+        self.queue_delay = queue_delay
+        self.build_duration = build_duration
+        self.log_lines = log_lines
+        self.plugins = plugins
+        self.update_center_plugins = update_center_plugins
+        self.agents = agents
+        self.latency = latency
+        self.lock = threading.RLock()
+        self.jobs = {}
+        self.queue = {}
+        self.queue_id = 0
+        self.background = {}
+        self.background_id = 0
+        self.registry = {}
+        self.requests = 0
+        self.bytes_sent = 0
+        self.connections = set()
+        self.httpd = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.jenkins = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests = 0
+            self.bytes_sent = 0
+            self.connections = set()
+
+    def stats(self):
+        with self.lock:
+            return dict(requests=self.requests, bytes=self.bytes_sent, connections=len(self.connections))
+
+    def job(self, name):
+        if name not in self.jobs:
+            params = [dict(name='VERSION', defaultParameterValue=dict(value='1.0'))] if name.endswith('-params') else []
+            self.jobs[name] = dict(name=name, next=1, builds={}, params=params)
+        return self.jobs[name]
+
+    def enqueue(self, name, params):
+        self.queue_id += 1
+        self.queue[self.queue_id] = dict(job=name, params=params, created=time.time(), number=None, cancelled=False)
+        return self.queue_id
+
+    def tick(self):
+        """Start the builds whose queue items waited long enough."""
+        now = time.time()
+        for queue_id, item in sorted(self.queue.items()):
+            if item['number'] is None and not item['cancelled'] and now >= item['created'] + self.queue_delay:
+                job = self.job(item['job'])
+                number = job['next']
+                job['next'] += 1
+                job['builds'][number] = dict(number=number, queue_id=queue_id, start=now, params=item['params'])
+                item['number'] = number
+
+    def building(self, build):
+        return time.time() < build['start'] + self.build_duration
+
+    def log(self, job, build):
+        """Return the console log written so far and whether the build still runs."""
+        done = min(1.0, (time.time() - build['start']) / self.build_duration) if self.build_duration else 1.0
+        lines = int(self.log_lines * done)
+        prefix = '[%s #%d] ' % (job['name'], build['number'])
+        text = ''.join('%sstep %06d: compiling module %06d of the benchmark project ... ok\n' % (prefix, line, line)
+                       for line in range(lines))
+        return text.encode('utf-8'), done < 1.0
+
+    def build_json(self, job, build):
+        building = self.building(build)
+        url = '%s/job/%s/%d/' % (self.url, '/job/'.join(job['name'].split('/')), build['number'])
+        return {
+            '_class': 'hudson.model.FreeStyleBuild',
+            'actions': [
+                {'_class': 'hudson.model.ParametersAction',
+                 'parameters': [dict(name=name, value=value) for name, value in sorted(build['params'].items())]},
+                {'_class': 'hudson.model.CauseAction', 'causes': [dict(userId='admin')]},
+            ],
+            'artifacts': [dict(fileName=path.split('/')[-1], relativePath=path, displayPath=path) for path in ARTIFACTS],
+            'building': building,
+            'description': None,
+            'displayName': '#%d' % build['number'],
+            'duration': 0 if building else int(self.build_duration * 1000),
+            'estimatedDuration': int(self.build_duration * 1000),
+            'fullDisplayName': '%s #%d' % (job['name'], build['number']),
+            'id': str(build['number']),
+            'keepLog': False,
+            'number': build['number'],
+            'queueId': build['queue_id'],
+            'result': None if building else 'SUCCESS',
+            'timestamp': int(build['start'] * 1000),
+            'url': url,
+        }
+
+    def job_json(self, job):
+        short_name = job['name'].split('/')[-1]
+        queue_item = None
+        for queue_id, item in self.queue.items():
+            if item['job'] == job['name'] and item['number'] is None and not item['cancelled']:
+                queue_item = dict(id=queue_id, params=''.join('\n%s=%s' % param for param in item['params'].items()))
+        return {
+            '_class': 'hudson.model.FreeStyleProject',
+            'name': short_name,
+            'fullName': job['name'],
+            'nextBuildNumber': job['next'],
+            'property': [{'_class': 'hudson.model.ParametersDefinitionProperty',
+                          'parameterDefinitions': job['params']}] if job['params'] else [],
+            'downstreamProjects': [],
+            'builds': [self.build_json(job, job['builds'][number]) for number in sorted(job['builds'], reverse=True)],
+            'queueItem': queue_item,
+        }
+
+    def queue_json(self, queue_id, item):
+        job = self.job(item['job'])
+        executable = None
+        if item['number'] is not None:
+            executable = dict(number=item['number'], url='%s/job/%s/%d/' % (self.url, job['name'], item['number']))
+        return {
+            '_class': 'hudson.model.Queue$LeftItem' if executable else 'hudson.model.Queue$WaitingItem',
+            'id': queue_id,
+            'cancelled': item['cancelled'],
+            'why': None if executable else 'Waiting for next available executor',
+            'inQueueSince': int(item['created'] * 1000),
+            'task': dict(name=job['name'], fullName=job['name']),
+            'params': ''.join('\n%s=%s' % param for param in item['params'].items()),
+            'actions': [dict(causes=[dict(userId='admin')])],
+            'executable': executable,
+        }
+
+    def plugins_json(self):
+        return dict(plugins=[dict(shortName='plugin-%04d' % index, longName='Benchmark plugin %d' % index,
+                                  version='1.%d' % index, enabled=True, active=True, pinned=index % 2 == 0,
+                                  hasUpdate=False, url='https://plugins.jenkins.io/plugin-%04d' % index,
+                                  dependencies=[dict(shortName='plugin-%04d' % dep, version='1.0', optional=False)
+                                                for dep in range(index % 5)])
+                             for index in range(self.plugins)])
+
+    def computers_json(self):
+        """Every tenth agent is offline, even agents are labelled linux and odd ones windows."""
+        computers = [{'_class': 'hudson.model.Hudson$MasterComputer', 'displayName': 'Built-In Node', 'offline': False}]
+        computers.extend({'_class': 'hudson.slaves.SlaveComputer', 'displayName': 'agent-%03d' % index,
+                          'offline': index % 10 == 9} for index in range(self.agents))
+        return dict(computer=computers)
+
+    def label_json(self, label):
+        return dict(nodes=[dict(nodeName='agent-%03d' % index) for index in range(self.agents)
+                           if label == ('linux', 'windows')[index % 2]])
+
+    def update_center(self):
+        plugins = {}
+        for index in range(self.update_center_plugins):
+            name = 'plugin-%04d' % index
+            plugins[name] = dict(name=name, version='2.%d' % index, sha1=base64.b64encode(
+                ('sha1 of %s' % name).encode('utf-8')[:20]).decode('ascii'),
+                url='%s/updates/latest/%s.hpi' % (self.url, name),
+                excerpt='Benchmark plugin %d with a description of a realistic length.' % index,
+                dependencies=[dict(name='plugin-%04d' % dep, version='1.0', optional=False)
+                              for dep in range(index % 5)])
+        return 'updateCenter.post(\n%s\n);' % json.dumps(dict(plugins=plugins))
+
+    def start_background(self, source):
+        """Start a background script that runs for build_duration seconds, return its id."""
+        self.background_id += 1
+        script_id = 'background-%d' % self.background_id
+        self.background[script_id] = dict(start=time.time(), source=source)
+        return script_id
+
+    def background_state(self, script_id, offset):
+        """Answer a background status script with a line of output per tenth of the run."""
+        script = self.background.get(script_id)
+        if script is None:
+            return dict(found=False)
+        elapsed = time.time() - script['start']
+        finished = elapsed >= self.build_duration
+        steps = 10 if finished else int(10 * elapsed / self.build_duration)
+        text = ''.join('step %d of %d characters of script\n' % (step, len(script['source'])) for step in range(steps))
+        state = dict(found=True, finished=finished, output=text[offset:], offset=len(text), result=None,
+                     exception=None, message=None, error=None, duration=int(min(elapsed, self.build_duration) * 1000))
+        if finished:
+            del self.background[script_id]
+            if 'throw ' in script['source']:
+                state.update(exception='java.lang.Exception', message='thrown',
+                             error='java.lang.Exception: thrown\n\tat Script1.run(Script1.groovy:1)\n')
+            else:
+                state['result'] = str(len(script['source']))
+        return state
+
+    def wait_states(self, states, deadline):
+        """Answer a server side wait script, like its Groovy would."""
+        while True:
+            with self.lock:
+                self.tick()
+                for state in states:
+                    if not state['building']:
+                        continue
+                    job = self.job(state['name'])
+                    if state['number'] is None:
+                        item = self.queue.get(state['queue_id'])
+                        if item is None or item['cancelled']:
+                            state.update(cancelled=item is not None, lost=item is None, building=False)
+                            continue
+                        if item['number'] is None:
+                            continue
+                        state['number'] = item['number']
+                        state['queue_time'] = int(self.queue_delay * 1000)
+                    state['building'] = self.building(job['builds'][state['number']])
+                    state['duration'] = None if state['building'] else int(self.build_duration * 1000)
+            if not any(state['building'] for state in states) or time.time() >= deadline:
+                return states
+            time.sleep(0.1)
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, status, body=b'', content_type='application/json', headers=None):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+            jenkins = self.server.jenkins
+            with jenkins.lock:
+                jenkins.bytes_sent += len(body)
+
+    def send_json(self, data, tree=None):
+        self.send(200, json.dumps(apply_tree(data, tree)))
+
+    def do_GET(self):
+        self.dispatch({})
+
+    def do_HEAD(self):
+        self.dispatch({})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else ''
+        self.dispatch(parse_qs(body))
+
+    def dispatch(self, form):
+        jenkins = self.server.jenkins
+        if jenkins.latency:
+            time.sleep(jenkins.latency)
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        tree = parse_tree(query['tree'][0]) if 'tree' in query else None
+        with jenkins.lock:
+            jenkins.requests += 1
+            jenkins.connections.add(self.client_address)
+            jenkins.tick()
+        if self.command == 'POST' and CRUMB not in (self.headers.get(CRUMB_FIELD), form.get(CRUMB_FIELD, [None])[0]):
+            return self.send(403, 'No valid crumb was included in the request', 'text/plain')
+        if url.path == '/crumbIssuer/api/json':
+            return self.send_json(dict(crumb=CRUMB, crumbRequestField=CRUMB_FIELD))
+        if url.path == '/api/json':
+            return self.send_json(dict(mode='NORMAL', useCrumbs=True), tree)
+        if url.path == '/scriptText':
+            return self.script(form.get('script', [''])[0])
+        if url.path == '/computer/api/json':
+            return self.send_json(jenkins.computers_json(), tree)
+        match = re.match(r'^/label/([^/]+)/api/json$', url.path)
+        if match:
+            return self.send_json(jenkins.label_json(unquote(match.group(1))), tree)
+        match = re.match(r'^/computer/([^/]+)/scriptText$', url.path)
+        if match:
+            script = form.get('script', [''])[0]
+            output = 'Result: %d characters of script on %s\n' % (len(script), unquote(match.group(1)))
+            return self.send(200, output + SCRIPT_END if SCRIPT_END in script else output, 'text/plain')
+        if url.path == '/pluginManager/api/json':
+            return self.send_json(jenkins.plugins_json(), tree)
+        if url.path.startswith('/pluginManager/plugin/'):
+            return self.send(200 if self.command == 'POST' else 405)
+        if url.path == '/updates/update-center.json':
+            return self.send(200, jenkins.update_center(), 'application/javascript')
+        if url.path.startswith('/updates/') and url.path.endswith('.hpi'):
+            return self.send(200, (url.path + '\n').encode('utf-8') * 20000, 'application/octet-stream')
+        with jenkins.lock:
+            return self.jenkins_api(jenkins, url.path, query, form, tree)
+
+    def script(self, script):
+        jenkins = self.server.jenkins
+        match = SERVER_WAIT.search(script)
+        batch = SCRIPTS_BATCH.search(script)
+        background = BACKGROUND_START.search(script)
+        status = BACKGROUND_STATUS.search(script)
+        registered = REGISTERED_RUN.search(script)
+        if registered:
+            install = REGISTERED_INSTALL.search(script)
+            with jenkins.lock:
+                if install:
+                    jenkins.registry[install.group(2)] = base64.b64decode(install.group(1)).decode('utf-8')
+                source = jenkins.registry.get(registered.group(1))
+            if source is None:
+                output = registered.group(2) + '\n'
+            else:
+                args = json.loads(base64.b64decode(registered.group(3)).decode('utf-8'))
+                output = 'Result: %d characters of script with %s\n' % (len(source), json.dumps(args, sort_keys=True))
+        elif background:
+            with jenkins.lock:
+                output = jenkins.start_background(base64.b64decode(background.group(1)).decode('utf-8')) + '\n'
+        elif status:
+            with jenkins.lock:
+                output = json.dumps(jenkins.background_state(status.group(1), int(status.group(2)))) + '\n'
+        elif batch:
+            scripts = json.loads(base64.b64decode(batch.group(1)).decode('utf-8'))
+            output = json.dumps([self.script_result(source) for source in scripts]) + '\n'
+        elif match:
+            states = json.loads(base64.b64decode(match.group(1)).decode('utf-8'))
+            states = jenkins.wait_states(states, time.time() + int(match.group(2)) / 1000.0)
+            output = json.dumps(states) + '\n'
+        else:
+            output = 'Result: %d characters of script\n' % len(script)
+        if SCRIPT_END in script:
+            output += SCRIPT_END
+        return self.send(200, output, 'text/plain')
+
+    @staticmethod
+    def script_result(source):
+        result = dict(output='Result: %d characters of script\n' % len(source), truncated=False, result=len(source),
+                      exception=None, message=None, error=None, duration=1)
+        if 'throw ' in source:
+            result.update(result=None, exception='java.lang.Exception', message='thrown',
+                          error='java.lang.Exception: thrown\n\tat Script1.run(Script1.groovy:1)\n')
+        return result
+
+    def jenkins_api(self, jenkins, path, query, form, tree):
+        if path == '/queue/api/json':
+            items = [jenkins.queue_json(queue_id, item) for queue_id, item in sorted(jenkins.queue.items())
+                     if item['number'] is None and not item['cancelled']]
+            return self.send_json(dict(items=items), tree)
+        if path == '/queue/cancelItem':
+            jenkins.queue[int(query['id'][0])]['cancelled'] = True
+            return self.send(204)
+        match = re.match(r'^/queue/item/(\d+)/api/json$', path)
+        if match:
+            item = jenkins.queue.get(int(match.group(1)))
+            if item is None:
+                return self.send(404, 'Not found', 'text/plain')
+            return self.send_json(jenkins.queue_json(int(match.group(1)), item), tree)
+        match = re.match(r'^/((?:job/[^/]+/)+)(.*)$', path)
+        if not match:
+            return self.send(404, 'Not found', 'text/plain')
+        name = '/'.join(unquote(part) for part in match.group(1).split('/')[1::2])
+        if name.startswith('missing'):
+            return self.send(404, 'Not found', 'text/plain')
+        job = jenkins.job(name)
+        rest = match.group(2).rstrip('/')
+        if rest in ('build', 'buildWithParameters'):
+            if self.command != 'POST':
+                return self.send(405)
+            params = dict((name, values[0]) for name, values in list(query.items()) + list(form.items())
+                          if name not in ('token', 'json', 'Submit', CRUMB_FIELD))
+            for param in job['params']:
+                params.setdefault(param['name'], param['defaultParameterValue']['value'])
+            queue_id = jenkins.enqueue(job['name'], params)
+            return self.send(201, headers=dict(Location='%s/queue/item/%d/' % (jenkins.url, queue_id)))
+        if rest == 'api/json':
+            return self.send_json(jenkins.job_json(job), tree)
+        match = re.match(r'^(\d+)/(.*)$', rest)
+        build = job['builds'].get(int(match.group(1))) if match else None
+        if build is None:
+            return self.send(404, 'Not found', 'text/plain')
+        page = match.group(2)
+        if page == 'api/json':
+            return self.send_json(jenkins.build_json(job, build), tree)
+        if page == 'consoleText':
+            return self.send(200, jenkins.log(job, build)[0], 'text/plain')
+        if page == 'logText/progressiveText':
+            text, more = jenkins.log(job, build)
+            headers = {'X-Text-Size': str(len(text))}
+            if more:
+                headers['X-More-Data'] = 'true'
+            return self.send(200, text[int(query.get('start', ['0'])[0]):], 'text/plain', headers)
+        if page.startswith('artifact/'):
+            content = (page + '\n').encode('utf-8') * (ARTIFACT_SIZE // (len(page) + 1))
+            start = 0
+            if self.headers.get('Range'):
+                start = int(self.headers['Range'].split('=')[1].split('-')[0])
+                if start >= len(content):
+                    return self.send(416)
+                return self.send(206, content[start:], 'application/octet-stream',
+                                 {'Content-Range': 'bytes %d-%d/%d' % (start, len(content) - 1, len(content))})
+            return self.send(200, content, 'application/octet-stream')
+        if page == 'stop':
+            return self.send(200)
+        return self.send(404, 'Not found', 'text/plain')
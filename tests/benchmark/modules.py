@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright: (c) Ansible Project
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Benchmark of the jenkins modules against a local fake Jenkins.
+
+Each scenario drives JenkinsBuild, JenkinsScript or JenkinsPlugin directly,
+in its own Python process like a task would, against the stand-in Jenkins of
+fake_jenkins.py that runs in this process. For every scenario it reports the
+wall time of the module, the requests, bytes and connections the fake
+Jenkins served and the peak RSS of the module process.
+
+    python tests/benchmark/modules.py [--latency 0.02] [scenario ...]
+
+No Jenkins is needed, so performance regressions can be caught offline.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import getpass
+import grp
+import importlib.util
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import ansible.module_utils  # noqa: E402
+ansible.module_utils.__path__.append(os.path.join(ROOT, 'module_utils'))
+
+from ansible.module_utils import basic  # noqa: E402
+from ansible.module_utils._text import to_bytes  # noqa: E402
+from fake_jenkins import FakeJenkins  # noqa: E402
+
+JOBS = ['benchmark-%d' % index for index in range(3)] + ['folder/benchmark-params']
+
+SCRIPT = '''
+def jobs = Jenkins.instance.getAllItems(Job.class)
+jobs.each { println("${it.fullName} ${it.lastBuild?.result}") }
+println("${jobs.size()} jobs")
+'''
+
+
+class ModuleReady(Exception):
+    """Raised with the AnsibleModule built by the main() of a module."""
+
+    def __init__(self, module):
+        self.module = module
+
+
+def load_module(name, args):
+    """Import a module from library and return it with an AnsibleModule built from its own argument_spec."""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, 'library', '%s.py' % name))
+    library = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(library)
+    # AnsibleModule reads the arguments from a file named on the command line, as with hacking/test-module
+    fd, path = tempfile.mkstemp(prefix='args-')
+    os.write(fd, to_bytes(json.dumps(dict(ANSIBLE_MODULE_ARGS=args))))
+    os.close(fd)
+    sys.argv[1:] = [path]
+
+    def capture(*args, **kwargs):
+        raise ModuleReady(basic.AnsibleModule(*args, **kwargs))
+
+    library.AnsibleModule = capture
+    try:
+        library.main()
+    except ModuleReady as e:
+        return library, e.module
+    raise RuntimeError('%s did not build an AnsibleModule' % name)
+
+
+def build(url, workdir, **options):
+    args = dict(jobs=[dict(name=name) for name in JOBS], url=url, user='admin', password='admin',
+                poll_interval=0.2, max_poll_interval=1, fail=True)
+    args.update(options)
+    library, module = load_module('jenkins_build', args)
+    result = library.JenkinsBuild(module).build_job()
+    return [build['build_info']['result'] for build in result['builds']]
+
+
+def script(url, workdir):
+    library, module = load_module('jenkins_run_script', dict(script=SCRIPT, url=url, user='admin', password='admin'))
+    return library.JenkinsScript(module).run_script()['output'].splitlines()[-1]
+
+
+def scripts(url, workdir):
+    library, module = load_module('jenkins_run_script', dict(scripts=[SCRIPT] * 30, url=url, user='admin',
+                                                             password='admin'))
+    return len(library.JenkinsScript(module).run_script()['results'])
+
+
+def nodes(url, workdir):
+    library, module = load_module('jenkins_run_script', dict(script=SCRIPT, nodes='all', url=url, user='admin',
+                                                             password='admin'))
+    return len(library.JenkinsScript(module).run_script()['nodes'])
+
+
+def background(url, workdir):
+    library, module = load_module('jenkins_run_script', dict(script=SCRIPT, background=True, poll_interval=0.2,
+                                                             max_poll_interval=1, url=url, user='admin',
+                                                             password='admin'))
+    return library.JenkinsScript(module).run_script()['output'].splitlines()[-1]
+
+
+def registered(url, workdir):
+    library, module = load_module('jenkins_run_script', dict(script=SCRIPT, registered=True, url=url, user='admin',
+                                                             password='admin'))
+    outputs = []
+    for index in range(30):
+        module.params['args'] = dict(index=index)
+        outputs.append(library.JenkinsScript(module).run_script()['output'])
+    return len(set(outputs))
+
+
+def plugin(url, workdir, state, **options):
+    args = dict(name='plugin-0003', state=state, url=url, url_username='admin', url_password='admin',
+                jenkins_home=workdir, updates_url=url + '/updates', owner=getpass.getuser(),
+                group=grp.getgrgid(os.getgid()).gr_name)
+    args.update(options)
+    library, module = load_module('jenkins_plugin', args)
+    # The settings main() applies after building the module
+    module.params['force_basic_auth'] = True
+    module.params['timeout'] = float(module.params['timeout'])
+    if module.params['state'] == 'latest':
+        module.params['state'] = 'present'
+        module.params['version'] = 'latest'
+    jp = library.JenkinsPlugin(module)
+    if state == 'pinned':
+        return jp.pin()
+    if not os.path.isdir(os.path.join(workdir, 'plugins')):
+        os.makedirs(os.path.join(workdir, 'plugins'))
+        with open(os.path.join(workdir, 'plugins', 'plugin-0003.jpi'), 'wb') as f:
+            f.write(b'installed plugin')
+    return jp.install()
+
+
+SCENARIOS = [
+    ('build', 'trigger and poll 4 builds', lambda url, workdir: build(url, workdir)),
+    ('build-server', 'trigger 4 builds and wait in Jenkins',
+     lambda url, workdir: build(url, workdir, wait_strategy='server')),
+    ('build-console', 'poll 4 builds with their console output',
+     lambda url, workdir: build(url, workdir, console_output=True)),
+    ('build-server-logs', 'wait for 4 builds in Jenkins and save their console logs',
+     lambda url, workdir: build(url, workdir, wait_strategy='server', console_log_dir=os.path.join(workdir, 'logs'))),
+    ('build-logs', 'stream 4 console logs and fetch the artifacts',
+     lambda url, workdir: build(url, workdir, console_log_dir=os.path.join(workdir, 'logs'), artifacts=['out/*'],
+                                artifacts_dest=os.path.join(workdir, 'artifacts'))),
+    ('script', 'run a script', script),
+    ('scripts', 'run 30 scripts in one request', scripts),
+    ('nodes', 'run a script on all the agents', nodes),
+    ('registered', 'register a script and run it 30 times with other args', registered),
+    ('background', 'run a script in the background and poll its output', background),
+    ('plugin-pin', 'read the plugin manager and pin a plugin',
+     lambda url, workdir: plugin(url, workdir, 'pinned')),
+    ('plugin-latest', 'download the update center and the latest plugin',
+     lambda url, workdir: plugin(url, workdir, 'latest')),
+]
+
+
+def peak_rss():
+    """Return the peak RSS of this process in MB."""
+    # On Linux ru_maxrss keeps the RSS of the benchmark process at the fork,
+    # with the logs of the fake Jenkins, VmHWM is that of the module only
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024 if sys.platform == 'darwin' else 1024.0)
+
+
+def worker(name, url, workdir):
+    """Run one scenario and print its timings as JSON, in a process of its own."""
+    scenario = dict((entry[0], entry[2]) for entry in SCENARIOS)[name]
+    start = time.time()
+    outcome = scenario(url, workdir)
+    print(json.dumps(dict(wall=time.time() - start, rss=peak_rss(), outcome=outcome)))
+
+
+def run(jenkins, name):
+    workdir = tempfile.mkdtemp(prefix='jenkins-benchmark-')
+    # The crumb and update center caches live in ~/.ansible/tmp, keep them and
+    # the temporary files out of the real home and /tmp
+    env = dict(os.environ, HOME=workdir, TMPDIR=workdir)
+    jenkins.reset_stats()
+    try:
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--worker', name,
+                                          jenkins.url, workdir], env=env)
+    finally:
+        shutil.rmtree(workdir)
+    measure = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    measure.update(jenkins.stats())
+    return measure
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        return worker(*sys.argv[2:5])
+
+    names = [entry[0] for entry in SCENARIOS]
+    parser = argparse.ArgumentParser(description='Benchmark the jenkins modules against a local fake Jenkins.')
+    parser.add_argument('scenarios', nargs='*', metavar='scenario', help='scenarios to run: %s' % ', '.join(names))
+    parser.add_argument('--queue-delay', type=float, default=0.5, help='seconds a build waits in the queue')
+    parser.add_argument('--build-duration', type=float, default=2.0, help='seconds a build runs')
+    parser.add_argument('--log-lines', type=int, default=20000, help='lines of the console log of a build')
+    parser.add_argument('--plugins', type=int, default=300, help='installed plugins in the plugin manager')
+    parser.add_argument('--update-center-plugins', type=int, default=2000, help='plugins in update-center.json')
+    parser.add_argument('--agents', type=int, default=50, help='agents of the controller')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    options = parser.parse_args()
+    for name in options.scenarios:
+        if name not in names:
+            parser.error('unknown scenario %s, choose from %s' % (name, ', '.join(names)))
+
+    jenkins = FakeJenkins(queue_delay=options.queue_delay, build_duration=options.build_duration,
+                          log_lines=options.log_lines, plugins=options.plugins,
+                          update_center_plugins=options.update_center_plugins, agents=options.agents,
+                          latency=options.latency).start()
+    print('%-17s %9s %9s %11s %6s %9s  %s' % ('scenario', 'wall s', 'requests', 'bytes', 'conns', 'rss MB',
+                                             'description'))
+    failed = False
+    try:
+        for name, description, scenario in SCENARIOS:
+            if options.scenarios and name not in options.scenarios:
+                continue
+            try:
+                measure = run(jenkins, name)
+            except subprocess.CalledProcessError as e:
+                failed = True
+                print('%-17s failed: %s' % (name, e.output.decode('utf-8', 'replace').strip()))
+                continue
+            print('%-17s %9.3f %9d %11d %6d %9.1f  %s' % (name, measure['wall'], measure['requests'],
+                                                          measure['bytes'], measure['connections'],
+                                                          measure['rss'], description))
+    finally:
+        jenkins.stop()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
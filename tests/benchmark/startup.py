@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright: (c) Ansible Project
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Startup benchmark of the jenkins modules.
+
+Every task runs its module in a new Python process, so the time to import
+the HTTP stack is paid on each task. This measures it in fresh interpreters,
+after AnsibleModule is imported as the modules do, for python-jenkins, which
+the modules used to import, and for the module_utils they import now.
+
+    python tests/benchmark/startup.py [runs]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import subprocess
+import sys
+
+MODULE_UTILS = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'module_utils'))
+
+CANDIDATES = [
+    ('python-jenkins', 'import jenkins'),
+    ('jenkins_client', 'import ansible.module_utils.jenkins_client'),
+    ('jenkins_builds', 'import ansible.module_utils.jenkins_builds'),
+]
+
+SNIPPET = '''
+import time
+import ansible.module_utils
+ansible.module_utils.__path__.append(%(module_utils)r)
+import ansible.module_utils.basic
+start = time.time()
+%(statement)s
+print(time.time() - start)
+'''
+
+
+def measure(statement, runs):
+    """Return the median import time of the statement in seconds."""
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for run in range(runs):
+            output = subprocess.check_output([sys.executable, '-c', SNIPPET % dict(module_utils=MODULE_UTILS,
+                                                                                 statement=statement)],
+                                             stderr=devnull)
+            times.append(float(output))
+    times.sort()
+    return times[len(times) // 2]
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    print('Median import time over %d runs' % runs)
+    for name, statement in CANDIDATES:
+        try:
+            median = measure(statement, runs)
+        except subprocess.CalledProcessError:
+            print('%-16s not installed' % name)
+            continue
+        print('%-16s %8.1f ms' % (name, median * 1000))
+
+
+if __name__ == '__main__':
+    main()